@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+scripts/bench_feeds.py
+
+Benchmarks del pipeline de feeds usando como fixtures los feeds reales de
+public/ (7b, isouls, prueba). Mide cada etapa por separado (troceo de ítems,
+claves, descripción, listas, enlaces) y una actualización completa de
+carpeta contra un servidor HTTP local que sirve los mismos feeds: en frío
+(update_dir: caché HTTP y de renders nuevas en cada repetición) y con las
+cachés de una pasada anterior (update_dir_warm).
+
+Uso:
+  python scripts/bench_feeds.py --out bench.json
+  python scripts/bench_feeds.py --out nuevo.json --compare bench.json
+"""
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = ["7b", "isouls", "prueba"]
+# ítems más recientes que se quitan del feed destino en la prueba completa
+NEW_ITEMS = 20
+
+# la caché HTTP de la prueba completa no debe tocar la del repo
+os.environ.setdefault("FEEDBUENO_CACHE_DIR", tempfile.mkdtemp(prefix="feedbueno-bench-cache-"))
+# sin límite de ritmo: las repeticiones contra el servidor local no deben esperar
+os.environ.setdefault("FEEDBUENO_RATE", "0")
+
+import update_feeds as uf
+
+# -------------- utilidades --------------
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(ROOT, "public", name, "feed.xml"), "r", encoding="utf-8") as f:
+        return f.read()
+
+def timed(func, repeat: int, setup=None) -> list:
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        func(arg) if setup else func()
+        times.append(time.perf_counter() - t0)
+    return times
+
+def summary(times: list, units: int) -> dict:
+    best = min(times)
+    return {
+        "units": units,
+        "min_s": round(best, 6),
+        "median_s": round(statistics.median(times), 6),
+        "units_per_s": round(units / best, 1) if best else None,
+    }
+
+def description_lines(desc: str) -> list:
+    body = uf.strip_cdata(desc or "")
+    body = re.sub(r"</p\s*>|<br\s*/?>", "\n", body, flags=re.IGNORECASE)
+    return re.sub(r"<p\b[^>]*>", "", body, flags=re.IGNORECASE).splitlines()
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+# -------------- servidor local --------------
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def start_stub(directory: str):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def drop_newest(xml: str, n: int) -> str:
+    items = uf.ITEM_RE.finditer(xml)
+    spans = [m.span() for _, m in zip(range(n), items)]
+    if not spans:
+        return xml
+    return xml[:spans[0][0]] + xml[spans[-1][1]:].lstrip()
+
+# -------------- etapas --------------
+
+def bench_fixture(name: str, repeat: int, base_url: str, work: str) -> dict:
+    xml = read_fixture(name)
+    items = uf.findall_items(xml)
+    eps = [uf.parse_episode(it) for it in items]
+    feed_img = uf.find_attr(xml, "itunes:image", "href")
+    atom_link = uf.find_attr(xml, "atom:link", "href")
+    lines = [ln.strip() for ep in eps for ln in description_lines(ep.description) if ln.strip()]
+    descs = [uf.process_description_block(uf.strip_cdata(ep.title), uf.strip_cdata(ep.link),
+                                          ep.image_url, ep.description, feed_img) for ep in eps]
+    res = {}
+
+    res["split"] = summary(timed(lambda: uf.findall_items(xml), repeat), len(items))
+    res["split_regex"] = summary(timed(lambda: list(uf.iter_items(xml, "regex")), repeat), len(items))
+    res["keys"] = summary(timed(lambda: [uf.parse_episode(it).key for it in items], repeat), len(items))
+    res["description"] = summary(timed(lambda: [
+        uf.process_description_block(uf.strip_cdata(ep.title), uf.strip_cdata(ep.link),
+                                     ep.image_url, ep.description, feed_img) for ep in eps
+    ], repeat), len(eps))
+    res["replace"] = summary(timed(lambda: [
+        uf.replace_description(ep.xml, d, str(i), atom_link) for i, (ep, d) in enumerate(zip(eps, descs))
+    ], repeat), len(eps))
+    res["lists"] = summary(timed(lambda: uf.detect_lists_from_lines(lines), repeat), len(lines))
+    res["linkify"] = summary(timed(lambda: [uf.transform_inline(ln) for ln in lines], repeat), len(lines))
+    # sin memo: lo que cuesta la primera vez que aparece cada línea
+    res["linkify_cold"] = summary(timed(lambda: [uf.transform_inline.__wrapped__(ln) for ln in lines], repeat), len(lines))
+
+    # actualización completa: feed destino sin los NEW_ITEMS más recientes
+    trimmed = drop_newest(xml, NEW_ITEMS)
+    feed_dir = os.path.join(work, "public", name)
+
+    def setup(cache_dir: str = None):
+        shutil.rmtree(feed_dir, ignore_errors=True)
+        os.makedirs(feed_dir)
+        with open(os.path.join(feed_dir, "feed.xml"), "w", encoding="utf-8") as f:
+            f.write(trimmed)
+        with open(os.path.join(feed_dir, "source.txt"), "w", encoding="utf-8") as f:
+            f.write(f"{base_url}/{name}.xml\n")
+        # sin cache_dir, cachés HTTP y de renders vacías: cada repetición renderiza
+        uf.fetcher.CACHE_DIR = cache_dir or tempfile.mkdtemp(prefix="cache-", dir=work)
+        uf.transform_inline.cache_clear()
+        uf.reset_run()
+        return feed_dir
+
+    def run(path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            uf.update_feed_dir(path)
+            uf.fetcher.finish_run()
+
+    new = min(NEW_ITEMS, len(items))
+    res["update_dir"] = summary(timed(run, repeat, setup), new)
+
+    # mismas entradas con la caché de una pasada anterior (renders en disco, 304)
+    warm = os.path.join(work, f"cache-warm-{name}")
+    run(setup(warm))
+    res["update_dir_warm"] = summary(timed(run, repeat, lambda: setup(warm)), new)
+    return res
+
+# -------------- comparación --------------
+
+def compare(old: dict, new: dict):
+    print(f"\n{'etapa':<14}{'fixture':<10}{'antes (s)':>12}{'ahora (s)':>12}{'x':>8}")
+    for stage, per_fixture in new["results"].items():
+        for name, r in per_fixture.items():
+            prev = old.get("results", {}).get(stage, {}).get(name)
+            if not prev:
+                continue
+            ratio = prev["min_s"] / r["min_s"] if r["min_s"] else float("inf")
+            print(f"{stage:<14}{name:<10}{prev['min_s']:>12.5f}{r['min_s']:>12.5f}{ratio:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del pipeline de feeds.")
+    parser.add_argument("--out", default="bench_output.json", help="Fichero JSON de resultados.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por etapa.")
+    parser.add_argument("--fixtures", nargs="*", default=FIXTURES, help="Carpetas de public/ a usar.")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para comparar.")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="feedbueno-bench-")
+    srv_dir = os.path.join(work, "srv")
+    os.makedirs(srv_dir)
+    for name in args.fixtures:
+        shutil.copyfile(os.path.join(ROOT, "public", name, "feed.xml"), os.path.join(srv_dir, f"{name}.xml"))
+    server, base_url = start_stub(srv_dir)
+
+    results = {}
+    try:
+        for name in args.fixtures:
+            print(f"⏱️  {name}")
+            for stage, r in bench_fixture(name, args.repeat, base_url, work).items():
+                results.setdefault(stage, {})[name] = r
+                print(f"   {stage:<12} {r['min_s']:.5f}s  ({r['units_per_s']} u/s)")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    out = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "item_parser": uf.ITEM_PARSER,
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"✅ Resultados en {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), out)
+
+if __name__ == "__main__":
+    main()
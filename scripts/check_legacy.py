@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+scripts/check_legacy.py
+
+Comprueba que el troceo de descripciones (split_description) y la edición de
+ítems con ItemXml dan lo mismo que las cadenas de regex a las que
+sustituyeron. Las versiones antiguas están copiadas aquí tal cual (legacy_*)
+y se comparan sobre todos los ítems de public/*/feed.xml:
+
+- descripciones: split_description + detect_lists_from_lines contra
+  protect_blocks / <p> / <br> / [[BLOCKn]] + unprotect_blocks;
+- render: render_uncached (replace_description + OP3 sobre ItemXml) contra
+  el re.sub encadenado de antes, con el ítem tal cual y sin description,
+  content:encoded, om:sec ni tags itunes (para probar también los añadidos);
+- vistas: OP3 + ensure_itunes_tags de update_iniciativas.
+
+Las diferencias en ítems con '\\' en el texto insertado son esperadas (las
+regex de antes lo trataban como escape de re) y se cuentan aparte.
+Con --fuzz N se prueban además N descripciones aleatorias.
+
+Uso:
+  python scripts/check_legacy.py
+  python scripts/check_legacy.py --fuzz 100000 --seed 1
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import update_feeds as uf
+import update_iniciativas as ui
+
+OP3_PREFIX = "https://op3.dev/e/"
+
+# -------------- implementaciones antiguas --------------
+
+def legacy_description_body(body: str) -> str:
+    protected, tokens = uf.protect_blocks(body)
+    protected = re.sub(r"</p\s*>", "\n", protected, flags=re.IGNORECASE)
+    protected = re.sub(r"<p\b[^>]*>", "", protected, flags=re.IGNORECASE)
+    protected = re.sub(r"<br\s*/?>", "\n", protected, flags=re.IGNORECASE)
+    protected = re.sub(r"(\[\[BLOCK\d+\]\])", r"\n\1\n", protected)
+    rebuilt = uf.detect_lists_from_lines(protected.splitlines())
+    return uf.unprotect_blocks(rebuilt, tokens)
+
+def legacy_process_description_block(title_txt, link_txt, image_url, description_inner, feed_img) -> str:
+    header = ""
+    if title_txt: header += f"<h3>{title_txt}</h3>\n"
+    if image_url and link_txt and image_url != feed_img:
+        header += f'<a href="{link_txt}"><img src="{image_url}" /></a>\n'
+    header += '<hr style="border:0;border-top:1px dashed #ccc;margin:20px 0;" />\n'
+    return header + legacy_description_body(uf.strip_cdata(description_inner or ""))
+
+def legacy_replace_description(item_xml: str, new_desc_html_cdata: str, sec_id: str, atom_link: str) -> str:
+    link = f"{atom_link}#{sec_id}" if atom_link else f"#{sec_id}"
+    inner_html = uf.strip_cdata(new_desc_html_cdata)
+    inner_html_with_aviso = inner_html.replace(
+        '<hr style="border:0;border-top:1px dashed #ccc;margin:20px 0;" />',
+        f'<p>Si no ves las imágenes, entra en <a href="{link}">{link}</a></p>\n'
+        '<hr style="border:0;border-top:1px dashed #ccc;margin:20px 0;" />'
+    )
+
+    desc_cdata = uf.enc_cdata(inner_html_with_aviso)
+    if re.search(r"<description\b", item_xml, flags=re.IGNORECASE):
+        item_xml = re.sub(r"<description\b[^>]*>.*?</description>",
+                          f"<description>{desc_cdata}</description>",
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+    else:
+        item_xml = re.sub(r"</item>\s*$", f"<description>{desc_cdata}</description>\n</item>",
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+
+    content_text = uf.escape_for_xml(inner_html_with_aviso)
+    content_tag = f'<content:encoded xmlns:content="http://purl.org/rss/1.0/modules/content/">{content_text}</content:encoded>'
+    if re.search(r"<content:encoded\b", item_xml, flags=re.IGNORECASE):
+        item_xml = re.sub(r"<content:encoded\b[^>]*>.*?</content:encoded>", content_tag,
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+    else:
+        item_xml = re.sub(r"</item>\s*$", f"{content_tag}\n</item>",
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+
+    if not re.search(r"<om:sec>", item_xml, flags=re.IGNORECASE):
+        item_xml = re.sub(r"</item>\s*$", f"<om:sec>{sec_id}</om:sec>\n</item>",
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+    return item_xml
+
+def legacy_op3(item_xml: str, op3_prefix: str, self_closing: bool = True) -> str:
+    # update_feeds pedía '/>' al final del enclosure; update_iniciativas, '/?>'
+    close = "/>" if self_closing else "/?>"
+    m = re.search(r'<enclosure\b([^>]*)url="([^"]+)"([^>]*)' + close, item_xml, flags=re.IGNORECASE)
+    if not m:
+        return item_xml
+    new_url = op3_prefix.strip() + m.group(2)
+    return re.sub(r'(<enclosure\b[^>]*url=")[^"]+(")', rf'\1{new_url}\2', item_xml, flags=re.IGNORECASE)
+
+def legacy_ensure_itunes_tags(item_xml: str, title_text: str) -> str:
+    if re.search(r"<itunes:season>", item_xml, flags=re.IGNORECASE):
+        item_xml = re.sub(r"<itunes:season>.*?</itunes:season>", "<itunes:season>1</itunes:season>",
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+    else:
+        item_xml = re.sub(r"</item>", "<itunes:season>1</itunes:season>\n</item>",
+                          item_xml, flags=re.IGNORECASE)
+    m = re.search(r"(\d+)", title_text)
+    episode_num = m.group(1) if m else "1"
+    if re.search(r"<itunes:episode>", item_xml, flags=re.IGNORECASE):
+        item_xml = re.sub(r"<itunes:episode>.*?</itunes:episode>", f"<itunes:episode>{episode_num}</itunes:episode>",
+                          item_xml, flags=re.IGNORECASE | re.DOTALL)
+    else:
+        item_xml = re.sub(r"</item>", f"<itunes:episode>{episode_num}</itunes:episode>\n</item>",
+                          item_xml, flags=re.IGNORECASE)
+    return item_xml
+
+# -------------- comparaciones --------------
+
+STRIPPED = ("description", "content:encoded", "om:sec", "itunes:season", "itunes:episode")
+
+def strip_children(item_xml: str) -> str:
+    """El ítem sin los hijos que reescribe el pipeline, para probar los añadidos."""
+    for name in STRIPPED:
+        item_xml = re.sub(rf"<{name}\b[^>]*>.*?</{name}>\s*", "", item_xml, flags=re.IGNORECASE | re.DOTALL)
+    return item_xml
+
+class Tally:
+    def __init__(self, name: str):
+        self.name, self.same, self.expected, self.fallback, self.loose, self.diffs = name, 0, 0, 0, 0, []
+
+    def check(self, label: str, new, old, expected_if: bool = False):
+        if new == old:
+            self.same += 1
+        elif expected_if:
+            self.expected += 1
+        else:
+            self.diffs.append(label)
+
+    def report(self) -> bool:
+        icon = "✅" if not self.diffs else "❌"
+        extra = f", {self.expected} esperadas (\\)" if self.expected else ""
+        extra += f", {self.fallback} por la cadena de regex" if self.fallback else ""
+        extra += f", {self.loose} por el troceo no estricto" if self.loose else ""
+        print(f"{icon} {self.name:<13} {self.same} iguales{extra}, {len(self.diffs)} distintas")
+        for label in self.diffs[:10]:
+            print(f"   - {label}")
+        return not self.diffs
+
+def check_description(tally: Tally, label: str, description: str):
+    body = uf.strip_cdata(description or "")
+    lines = uf.split_description(body)
+    if lines is None:
+        # process_description_block usa entonces la cadena de regex de siempre
+        # o, por encima de LEGACY_MAX, el troceo no estricto
+        if len(body) <= uf.LEGACY_MAX:
+            tally.fallback += 1
+        else:
+            tally.loose += 1
+        return
+    tally.check(label, uf.detect_lists_from_lines(lines), legacy_description_body(body))
+
+def legacy_or_error(func, *args):
+    try:
+        return func(*args)
+    except re.error as e:
+        return f"re.error: {e}"
+
+def check_feed(path: str, tallies: dict):
+    with open(path, "r", encoding="utf-8") as f:
+        xml = f.read()
+    name = os.path.basename(os.path.dirname(path))
+    feed_img = uf.find_attr(xml, "itunes:image", "href")
+    atom_link = uf.find_attr(xml, "atom:link", "href")
+
+    for i, item_xml in enumerate(uf.findall_items(xml)):
+        for variant, source in (("", item_xml), (" sin hijos", strip_children(item_xml))):
+            ep = uf.parse_episode(source)
+            label = f"{name} #{i}{variant}"
+            sec_id = uf.sec_candidate(ep, i)
+            if not variant:
+                check_description(tallies["descripciones"], label, ep.description)
+
+            old_desc = legacy_process_description_block(
+                uf.strip_cdata(ep.title), uf.strip_cdata(ep.link), ep.image_url, ep.description, feed_img)
+            backslash = "\\" in old_desc or "\\" in (uf.find_attr(source, "enclosure", "url") or "")
+            for prefix in ("", OP3_PREFIX):
+                old = legacy_or_error(legacy_replace_description, ep.xml, old_desc, sec_id, atom_link)
+                if prefix:
+                    old = legacy_or_error(legacy_op3, old, prefix)
+                new = uf.render_uncached(ep, feed_img, atom_link, sec_id, prefix)
+                tally_label = f"{label} op3" if prefix else label
+                tallies["render"].check(tally_label, new, old, backslash)
+
+            title_txt = uf.strip_cdata(ep.title)
+            rendered = uf.render_uncached(ep, feed_img, atom_link, sec_id)
+            old = legacy_or_error(legacy_ensure_itunes_tags,
+                                  legacy_or_error(legacy_op3, rendered, OP3_PREFIX, False), title_txt)
+            item = uf.ItemXml(rendered)
+            uf.apply_op3(item, OP3_PREFIX)
+            tallies["vistas"].check(label, ui.ensure_itunes_tags(item, title_txt), old, backslash)
+
+# -------------- descripciones aleatorias --------------
+
+FUZZ_PIECES = (
+    "<p>", "</p>", "<P class=\"x\">", "<p\n>", "</p >", "<br>", "<br/>", "<BR />",
+    "<ol>", "</ol>", "<ul>", "</ul>", "<li>", "</li>", "<a href=\"https://ejemplo.com\">", "</a>",
+    "<pre>", "</pre>", "<code>", "</code>", "[[BLOCK0]]", "<", ">", "\n", " ",
+    "texto", "1. uno", "2) dos", "- guion", "* punto", "https://ejemplo.com/img.png",
+)
+
+def fuzz(tally: Tally, count: int, seed: int):
+    rnd = random.Random(seed)
+    for n in range(count):
+        body = "".join(rnd.choice(FUZZ_PIECES) for _ in range(rnd.randint(1, 30)))
+        check_description(tally, f"fuzz #{n}: {body!r}", body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara split_description e ItemXml con las regex de antes.")
+    parser.add_argument("--fuzz", type=int, default=0, help="Descripciones aleatorias a probar además de los feeds.")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla de --fuzz.")
+    args = parser.parse_args()
+
+    tallies = {name: Tally(name) for name in ("descripciones", "render", "vistas")}
+    paths = sorted(glob.glob(os.path.join(ROOT, "public", "*", "feed.xml")))
+    for path in paths:
+        check_feed(path, tallies)
+    print(f"🔍 {len(paths)} feeds de public/")
+    if args.fuzz:
+        tallies["fuzz"] = Tally("fuzz")
+        fuzz(tallies["fuzz"], args.fuzz, args.seed)
+
+    ok = all([t.report() for t in tallies.values()])
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# scripts/feed_index.py
+
+"""
+Índice de claves de un feed destino (feed.idx, junto a su feed.xml).
+
+Guarda un resumen de 64 bits de la clave normalizada de cada ítem y los
+valores de <om:sec>, para no reparsear el feed entero en cada ejecución.
+También recuerda qué om:sec tuvo cada clave, aunque el ítem desaparezca,
+para que los enlaces atom_link#sec no cambien entre ejecuciones.
+El índice se da por bueno si coincide con el tamaño y la fecha del feed o,
+si la fecha no cuadra (p. ej. tras un checkout), con su hash.
+"""
+
+import hashlib
+import json
+import os
+
+INDEX_VERSION = 2
+INDEX_NAME = "feed.idx"
+
+def key_digest(key: str) -> str:
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+
+def file_digest(feed_file: str, chunk_size: int = 64 * 1024) -> str:
+    """sha1 del feed leído por trozos en modo texto (\r\n y \r pasan a \n)."""
+    h = hashlib.sha1()
+    with open(feed_file, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return h.hexdigest()
+            h.update(chunk.encode("utf-8"))
+
+def index_path(feed_file: str) -> str:
+    return os.path.join(os.path.dirname(feed_file), INDEX_NAME)
+
+def next_sec_candidate(candidate: str) -> str:
+    return str(int(candidate) + 1) if candidate.isdigit() else candidate + "_x"
+
+class FeedIndex:
+    __slots__ = ("keys", "secs", "sec_by_key", "size", "mtime_ns", "sha1", "rebuilt",
+                 "_used", "_jump")
+
+    def __init__(self, keys=(), secs=(), sec_by_key=None):
+        self.keys = set(keys)
+        self.secs = list(secs)
+        self.sec_by_key = dict(sec_by_key or {})
+        self.size = self.mtime_ns = 0
+        self.sha1 = ""
+        self.rebuilt = False
+        self._used = None
+        self._jump = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key_digest(key) in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, sec: str = None):
+        digest = key_digest(key)
+        self.keys.add(digest)
+        if sec:
+            self.secs.append(sec)
+            self.sec_by_key[digest] = sec
+            if self._used is not None:
+                self._used.add(sec)
+
+    # --- reparto de om:sec ---
+
+    def allocate_sec(self, key: str, candidate: str) -> str:
+        """
+        Devuelve un om:sec libre para `key`: el que ya tuvo antes si sigue
+        libre, o `candidate` (+1 / _x mientras choque). Los saltos se
+        memorizan, así que cada reparto cuesta O(1) amortizado, y el id queda
+        reservado para el resto de la ejecución.
+        """
+        if self._used is None:
+            self._used = set(self.secs)
+        digest = key_digest(key) if key is not None else None
+        sec = self.sec_by_key.get(digest)
+        if sec is None or sec in self._used:
+            path, sec = [], candidate
+            while sec in self._used:
+                path.append(sec)
+                sec = self._jump.get(sec) or next_sec_candidate(sec)
+            for p in path:
+                self._jump[p] = sec
+        self._used.add(sec)
+        if digest is not None:
+            self.sec_by_key[digest] = sec
+        return sec
+
+    def matches(self, feed_file: str, feed_sha1: str = None) -> bool:
+        """
+        ¿Sigue valiendo para el feed? Sin `feed_sha1` solo se mira el tamaño y
+        la fecha; con él, una fecha distinta vale si el hash coincide.
+        """
+        try:
+            st = os.stat(feed_file)
+        except OSError:
+            return False
+        if st.st_size != self.size or not self.sha1:
+            return False
+        if st.st_mtime_ns != self.mtime_ns:
+            if feed_sha1 != self.sha1:
+                return False
+            self.mtime_ns = st.st_mtime_ns
+        return True
+
+    def stamp(self, feed_file: str, feed_sha1: str):
+        st = os.stat(feed_file)
+        self.size, self.mtime_ns, self.sha1 = st.st_size, st.st_mtime_ns, feed_sha1
+
+    def save(self, feed_file: str):
+        path = index_path(feed_file)
+        data = {
+            "version": INDEX_VERSION,
+            "size": self.size, "mtime_ns": self.mtime_ns, "sha1": self.sha1,
+            "keys": sorted(self.keys), "secs": self.secs,
+            "sec_by_key": dict(sorted(self.sec_by_key.items())),
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, feed_file: str):
+        try:
+            with open(index_path(feed_file), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return None
+        idx = cls(data.get("keys") or (), data.get("secs") or (), data.get("sec_by_key"))
+        idx.size, idx.mtime_ns, idx.sha1 = data.get("size", 0), data.get("mtime_ns", 0), data.get("sha1", "")
+        return idx
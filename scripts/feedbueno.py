@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+scripts/feedbueno.py
+
+Punto de entrada único de los updaters. Ejecuta una o varias órdenes en el
+mismo proceso, que comparten la caché HTTP, las descargas de la ejecución
+(cada URL se baja una vez aunque la usen varias órdenes) y la caché de
+renders. Los módulos de cada orden (y requests, lxml...) se importan solo al
+ejecutarla, así que --help o una orden sin nada que hacer arrancan al momento.
+
+Órdenes:
+  update        update_feeds.py (source.txt)
+  with-image    update_feeds_with_image.py (imagen.txt)
+  iniciativas   update_iniciativas.py (view.txt, o --text y --source)
+  refresh       refresh_podcast_feeds.py (feed0.xml); no entra en "all"
+                porque reescribe el feed entero y se lanza a mano
+  backfill      mete todo el histórico de las fuentes de una carpeta nueva,
+                renderizando en varios procesos (--workers); pide --only
+  all           update, with-image e iniciativas
+
+Uso:
+  python scripts/feedbueno.py all
+  python scripts/feedbueno.py update iniciativas --only imetal2 --only imario
+  python scripts/feedbueno.py iniciativas --text "Iniciativa Mario" --source imario.txt
+  python scripts/feedbueno.py backfill --only nuevo --workers 4
+"""
+import argparse
+import os
+import sys
+
+ALL = ("update", "with-image", "iniciativas")
+
+def run_update(base: str, args):
+    import update_feeds
+    update_feeds.update_all(base, args.only)
+
+def run_with_image(base: str, args):
+    import update_feeds_with_image
+    update_feeds_with_image.update_all_with_image(base, args.only)
+
+def run_iniciativas(base: str, args):
+    import update_iniciativas
+    update_iniciativas.update_all_iniciativas(base, args.text, args.source, args.only)
+
+def run_refresh(base: str, args):
+    import refresh_podcast_feeds
+    refresh_podcast_feeds.refresh_all(base, args.only)
+
+def run_backfill(base: str, args):
+    import update_feeds
+    for path in update_feeds.feed_dirs(base, args.only):
+        if update_feeds.has_image_feed(path):
+            import update_feeds_with_image
+            update_feeds_with_image.backfill_feed_dir_with_image(path, args.workers)
+        else:
+            update_feeds.backfill_feed_dir(path, workers=args.workers)
+
+COMMANDS = {
+    "update": run_update,
+    "with-image": run_with_image,
+    "iniciativas": run_iniciativas,
+    "refresh": run_refresh,
+    "backfill": run_backfill,
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Actualiza los feeds de public/ en un solo proceso.",
+        epilog="Órdenes: " + ", ".join(COMMANDS) + ", all (= " + ", ".join(ALL) + ").",
+    )
+    parser.add_argument("commands", nargs="+", choices=list(COMMANDS) + ["all"], metavar="orden",
+                        help="Qué ejecutar, en este orden.")
+    parser.add_argument("--only", action="append", metavar="CARPETA",
+                        help="Solo esta carpeta de public/ (se puede repetir).")
+    parser.add_argument("--text", help="iniciativas: texto a buscar en el título (modo clásico).")
+    parser.add_argument("--source", help="iniciativas: archivo fuente, p. ej. imario.txt (modo clásico).")
+    parser.add_argument("--base", default=os.path.join(os.getcwd(), "public"),
+                        help="Carpeta de los feeds (por defecto ./public).")
+    parser.add_argument("--workers", type=int,
+                        help="backfill: procesos para renderizar (por defecto uno por CPU).")
+    args = parser.parse_args(argv)
+    if bool(args.text) != bool(args.source):
+        parser.error("--text y --source van juntos")
+    if "backfill" in args.commands and not args.only:
+        parser.error("backfill necesita --only con las carpetas a rellenar")
+    return args
+
+def expand(commands: list) -> list:
+    out = []
+    for cmd in commands:
+        for c in (ALL if cmd == "all" else (cmd,)):
+            if c not in out:
+                out.append(c)
+    return out
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not os.path.isdir(args.base):
+        print(f"❌ No existe la carpeta '{args.base}'")
+        return 1
+    for name in args.only or ():
+        if not os.path.isdir(os.path.join(args.base, name)):
+            print(f"⚠️  --only {name}: no existe en {args.base}")
+    import tracing
+
+    commands = expand(args.commands)
+    with tracing.run("feedbueno", commands=commands, only=args.only):
+        for cmd in commands:
+            print(f"\n▶️  {cmd}")
+            with tracing.span(cmd):
+                COMMANDS[cmd](args.base, args)
+        # solo si alguna orden ha llegado a cargar fetcher
+        fetcher = sys.modules.get("fetcher")
+        if fetcher is not None:
+            fetcher.finish_run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,929 @@
+# scripts/fetcher.py
+
+"""
+Capa de descarga de fuentes compartida por los updaters.
+
+Permite lanzar en paralelo todas las URLs de todas las carpetas antes de
+procesarlas; el procesado y la escritura siguen siendo secuenciales y en
+el orden de source.txt, así que el feed resultante es idéntico.
+
+Además guarda en disco una caché HTTP (ETag / Last-Modified y
+redirecciones permanentes) para que las fuentes que no han cambiado
+respondan con 304 y no se vuelvan a procesar.
+
+Cada URL se descarga una sola vez por ejecución: el resultado se comparte
+entre carpetas y, si hay identificador de ejecución, también entre las
+distintas invocaciones de un mismo job (spool en disco).
+
+Todas las peticiones salen de una sesión compartida (keep-alive, pool de
+conexiones por host, gzip/br) con un limitador de ritmo por host, y el
+resumen final cuenta conexiones reutilizadas y bytes en la red.
+
+Las descargas tienen un presupuesto de tiempo por ejecución, reintentos con
+espera aleatoria para errores transitorios y un cortocircuito por fuente que
+se guarda con la caché: una fuente que falla en varias ejecuciones seguidas
+se salta durante un tiempo que se dobla con cada fallo, y después se prueba
+con un solo intento corto. Así un puñado de fuentes muertas no alarga la
+ejecución más allá del presupuesto.
+
+Con FEEDBUENO_HEAD_KB solo se piden los primeros KB de cada fuente (Range,
+o cortando la descarga si el servidor no lo admite), que es donde están los
+episodios nuevos. fetch_full() baja la fuente entera cuando al consumidor
+no le basta con la cabeza.
+
+Una línea de source.txt puede dar varias URLs de la misma fuente separadas
+por "|" (espejos, en orden de preferencia). Se pide la primera y, si no ha
+respondido en el percentil FEEDBUENO_HEDGE_PCT de lo que suele tardar su
+host, también la siguiente; vale la primera respuesta buena. La línea entera
+sigue siendo el nombre de la fuente; validadores y cortocircuito van por
+espejo.
+
+Configuración por variables de entorno:
+  FEEDBUENO_CACHE_DIR     carpeta de la caché (por defecto .cache/feedbueno)
+  FEEDBUENO_RUN_ID        identificador de ejecución para el spool (por
+                          defecto GITHUB_RUN_ID-GITHUB_RUN_ATTEMPT)
+  FEEDBUENO_MAX_WORKERS   hilos de descarga (por defecto 8)
+  FEEDBUENO_PER_HOST      descargas simultáneas por host (por defecto 4)
+  FEEDBUENO_HOST_LIMITS   límites por host concretos, p. ej.
+                          "www.ivoox.com=2,feeds.feedburner.com=1"
+  FEEDBUENO_RATE          peticiones por segundo y host (4; 0 = sin límite)
+  FEEDBUENO_HOST_RATES    ritmos por host concretos, p. ej. "www.ivoox.com=2"
+  FEEDBUENO_BURST         ráfaga permitida por host (igual que el ritmo)
+  FEEDBUENO_DEADLINE      segundos de descargas por ejecución (300; 0 = sin límite)
+  FEEDBUENO_RETRIES       reintentos por error transitorio (2)
+  FEEDBUENO_BREAKER_AFTER fallos seguidos que abren el cortocircuito (2)
+  FEEDBUENO_BREAKER_HOURS primer periodo sin pedir la fuente (6 h; se dobla
+                          en cada fallo, hasta 7 días)
+  FEEDBUENO_HEAD_KB       KB de cabeza que se piden de cada fuente (0 = la
+                          fuente entera, por defecto)
+  FEEDBUENO_HEDGE_PCT     percentil de latencia del host tras el que se pide
+                          el siguiente espejo (90)
+  FEEDBUENO_HEDGE_AFTER   espera antes del siguiente espejo mientras el host
+                          no tiene bastantes muestras (2 s)
+"""
+
+import codecs
+import hashlib
+import json
+import math
+import os
+import queue
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import tracing
+
+USER_AGENT = "FeedbuenoUpdater/1.0"
+TIMEOUT = 20
+BODY_CHUNK = 64 * 1024
+
+CACHE_DIR = os.environ.get("FEEDBUENO_CACHE_DIR") or os.path.join(os.getcwd(), ".cache", "feedbueno")
+
+def _default_run_id() -> str:
+    run = os.environ.get("GITHUB_RUN_ID", "")
+    return f"{run}-{os.environ.get('GITHUB_RUN_ATTEMPT', '1')}" if run else ""
+
+RUN_ID = os.environ.get("FEEDBUENO_RUN_ID") or _default_run_id()
+
+MAX_WORKERS = int(os.environ.get("FEEDBUENO_MAX_WORKERS", "8"))
+PER_HOST = int(os.environ.get("FEEDBUENO_PER_HOST", "4"))
+
+# -------------- límites por host --------------
+
+def parse_host_limits(spec: str) -> dict:
+    limits = {}
+    for part in (spec or "").split(","):
+        host, _, value = part.partition("=")
+        if host.strip() and value.strip().isdigit():
+            limits[host.strip().lower()] = max(1, int(value))
+    return limits
+
+HOST_LIMITS = parse_host_limits(os.environ.get("FEEDBUENO_HOST_LIMITS", ""))
+
+_host_sems = {}
+_host_lock = threading.Lock()
+
+def host_of(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+def _host_semaphore(host: str) -> threading.Semaphore:
+    with _host_lock:
+        sem = _host_sems.get(host)
+        if sem is None:
+            sem = _host_sems[host] = threading.BoundedSemaphore(HOST_LIMITS.get(host, PER_HOST))
+        return sem
+
+# -------------- ritmo por host --------------
+
+def parse_host_rates(spec: str) -> dict:
+    rates = {}
+    for part in (spec or "").split(","):
+        host, _, value = part.partition("=")
+        try:
+            rates[host.strip().lower()] = max(0.0, float(value))
+        except ValueError:
+            continue
+    return rates
+
+RATE = float(os.environ.get("FEEDBUENO_RATE", "4"))
+HOST_RATES = parse_host_rates(os.environ.get("FEEDBUENO_HOST_RATES", ""))
+BURST = float(os.environ.get("FEEDBUENO_BURST", "0"))
+
+class TokenBucket:
+    """`rate` peticiones por segundo, con ráfagas de hasta `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate, self.burst = rate, max(1.0, burst)
+        self.tokens, self.stamp = self.burst, time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Toma un token y devuelve los segundos que hay que esperar para usarlo."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def cancel(self):
+        with self.lock:
+            self.tokens += 1
+
+_buckets = {}
+
+def _bucket(host: str):
+    """None si el host no tiene límite de ritmo."""
+    with _host_lock:
+        if host not in _buckets:
+            rate = HOST_RATES.get(host, RATE)
+            _buckets[host] = TokenBucket(rate, BURST or rate) if rate > 0 else None
+        return _buckets[host]
+
+def _throttle(host: str):
+    bucket = _bucket(host)
+    if bucket is None:
+        return
+    wait = bucket.reserve()
+    if wait <= 0:
+        return
+    if wait >= remaining():
+        bucket.cancel()
+        raise SourceUnavailable(f"sin tiempo: presupuesto de {DEADLINE:.0f}s agotado")
+    http_cache().count("throttled_ms", int(wait * 1000))
+    tracing.add("throttled_ms", int(wait * 1000))
+    time.sleep(wait)
+
+# -------------- caché HTTP en disco --------------
+
+class HttpCache:
+    """
+    Validadores HTTP por URL de fuente, cuerpos de la última respuesta 200,
+    redirecciones permanentes y qué versión de cada fuente ha procesado ya
+    cada feed destino. Se carga al primer uso y se guarda con save().
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "redirects": 0, "skipped": 0, "spooled": 0,
+                      "retries": 0, "failed": 0, "open": 0, "no_time": 0, "heads": 0, "head_full": 0,
+                      "hedged": 0, "mirror_wins": 0,
+                      "wire_bytes": 0, "body_bytes": 0, "throttled_ms": 0}
+        self.entries = self._load("http.json")
+        self.seen = self._load("seen.json")
+        self.breaker = self._load("breaker.json")
+        self.latency = self._load("latency.json")
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.root, *parts)
+
+    def _load(self, name: str) -> dict:
+        try:
+            with open(self._path(name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _dump(self, name: str, data: dict):
+        tmp = self._path(name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self._path(name))
+
+    def body_path(self, version: str) -> str:
+        return self._path("bodies", version + ".body")
+
+    def cached(self, url: str, entry: dict):
+        """Fetched del cuerpo guardado (sin leerlo todavía), o None si no está."""
+        version = entry.get("version")
+        if not version or not os.path.exists(self.body_path(version)):
+            return None
+        return Fetched(url, version, entry.get("encoding") or "utf-8", path=self.body_path(version),
+                       partial=bool(entry.get("partial")))
+
+    def store(self, url: str, final_url: str, r, body: "BodyFile", encoding: str, partial: bool = False) -> str:
+        version = body.commit()
+        entry = {
+            "version": version,
+            "encoding": encoding,
+            "etag": r.headers.get("ETag", ""),
+            "last_modified": r.headers.get("Last-Modified", ""),
+        }
+        if partial:
+            entry["partial"] = True
+        if final_url != url:
+            entry["redirect"] = final_url
+        with self.lock:
+            self.entries[url] = entry
+        return version
+
+    # --- spool de la ejecución actual ---
+
+    def spool_path(self, url: str) -> str:
+        return self._path("run", RUN_ID, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def spool_read(self, url: str):
+        if not RUN_ID:
+            return None
+        try:
+            with open(self.spool_path(url), "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return self.cached(url, snap)
+
+    def spool_write(self, url: str, fetched: "Fetched"):
+        if not RUN_ID:
+            return
+        snap = {"url": url, "version": fetched.version, "encoding": fetched.encoding,
+                "partial": fetched.partial}
+        os.makedirs(os.path.dirname(self.spool_path(url)), exist_ok=True)
+        tmp = self.spool_path(url) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False)
+        os.replace(tmp, self.spool_path(url))
+
+    def _clean_spools(self) -> set:
+        """Borra spools de ejecuciones anteriores; devuelve las versiones vivas."""
+        live, runs = set(), self._path("run")
+        if not os.path.isdir(runs):
+            return live
+        for run in os.listdir(runs):
+            path = os.path.join(runs, run)
+            if run != RUN_ID:
+                shutil.rmtree(path, ignore_errors=True); continue
+            for name in os.listdir(path):
+                try:
+                    with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                        live.add(json.load(f).get("version"))
+                except (OSError, ValueError):
+                    pass
+        return live
+
+    # --- cortocircuito por fuente ---
+
+    def circuit(self, url: str) -> str:
+        """"closed" (normal), "open" (no pedirla) o "probe" (un intento corto)."""
+        with self.lock:
+            state = self.breaker.get(url)
+        if not state or state.get("failures", 0) < BREAKER_AFTER:
+            return "closed"
+        return "open" if time.time() < state.get("until", 0) else "probe"
+
+    def record_failure(self, url: str, error: Exception):
+        with self.lock:
+            state = self.breaker.setdefault(url, {"failures": 0})
+            state["failures"] += 1
+            state["error"] = str(error)[:200]
+            extra = state["failures"] - BREAKER_AFTER
+            if extra >= 0:
+                state["until"] = time.time() + min(BREAKER_MAX, BREAKER_BASE * 2 ** extra)
+            self.stats["failed"] += 1
+
+    def record_success(self, url: str):
+        with self.lock:
+            self.breaker.pop(url, None)
+
+    # --- latencias por host (para los espejos) ---
+
+    def observe(self, host: str, seconds: float):
+        with self.lock:
+            samples = self.latency.setdefault(host, [])
+            samples.append(round(seconds, 3))
+            del samples[:-LATENCY_SAMPLES]
+
+    def hedge_delay(self, host: str) -> float:
+        """Segundos que se espera a `host` antes de pedir el siguiente espejo."""
+        with self.lock:
+            samples = sorted(self.latency.get(host) or ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_AFTER
+        rank = math.ceil(len(samples) * min(max(HEDGE_PCT, 0), 100) / 100)
+        return samples[max(rank, 1) - 1]
+
+    def count(self, stat: str, n: int = 1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self.lock:
+            self._dump("http.json", self.entries)
+            self._dump("seen.json", self.seen)
+            self._dump("breaker.json", self.breaker)
+            self._dump("latency.json", self.latency)
+            live = {e.get("version") for e in self.entries.values()}
+        live |= self._clean_spools()
+        # borrar cuerpos que ya no referencia ninguna URL
+        bodies = self._path("bodies")
+        if os.path.isdir(bodies):
+            for name in os.listdir(bodies):
+                if name[:-len(".body")] not in live:
+                    try: os.remove(os.path.join(bodies, name))
+                    except OSError: pass
+
+    def report(self) -> str:
+        st = self.stats
+        text = (f"📦 Caché HTTP: {st['hits']} sin cambios (304), {st['misses']} descargas completas, "
+                f"{st['spooled']} reutilizadas de esta ejecución, "
+                f"{st['redirects']} redirecciones ahorradas, {st['skipped']} fuentes ya procesadas")
+        if st["retries"] or st["failed"] or st["open"] or st["no_time"]:
+            text += (f"\n🩺 Fuentes: {st['retries']} reintentos, {st['failed']} fallidas, "
+                     f"{st['open']} saltadas por fallos anteriores, {st['no_time']} sin tiempo")
+        net = connection_stats()
+        if net["requests"]:
+            text += (f"\n🔌 Red: {net['requests']} peticiones en {net['connections']} conexiones "
+                     f"({net['reused']} reutilizadas), {st['wire_bytes'] / 1024:.0f} KB transferidos "
+                     f"({st['body_bytes'] / 1024:.0f} KB sin comprimir), "
+                     f"{st['throttled_ms'] / 1000:.1f}s de espera acumulada por el límite de ritmo")
+        if st["heads"] or st["head_full"]:
+            text += (f"\n✂️  Cabezas: {st['heads']} fuentes bajadas solo en parte ({HEAD_KB} KB), "
+                     f"{st['head_full']} pedidas enteras")
+        if st["hedged"]:
+            text += (f"\n🪞 Espejos: {st['hedged']} peticiones a un segundo espejo por lentitud, "
+                     f"{st['mirror_wins']} fuentes servidas por un espejo que no era el primero")
+        return text
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def http_cache() -> HttpCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache(CACHE_DIR)
+        return _cache
+
+# -------------- descarga --------------
+
+class Fetched:
+    """
+    Resultado de descargar una fuente: versión (hash de los bytes del cuerpo),
+    codificación y el fichero de la caché con el cuerpo. No se guarda nada del
+    cuerpo en memoria: iter_text() lo lee y decodifica por trozos cada vez, y
+    una fuente que no ha cambiado no se llega ni a leer. `partial` indica que
+    solo se tiene la cabeza del documento (FEEDBUENO_HEAD_KB); el último ítem
+    puede quedar cortado.
+    """
+    __slots__ = ("url", "version", "encoding", "partial", "path")
+
+    def __init__(self, url: str, version: str, encoding: str, path: str, partial: bool = False):
+        self.url = url
+        self.version = version
+        self.encoding = encoding
+        self.partial = partial
+        self.path = path
+
+    def iter_text(self, chunk_size: int = BODY_CHUNK):
+        try:
+            decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+class BodyFile:
+    """
+    Cuerpo de una respuesta escrito en bodies/ a medida que llega, con su
+    hash y sus primeros bytes (para la codificación), sin tenerlo entero en
+    memoria. commit() le da su nombre definitivo, la versión.
+    """
+    def __init__(self, cache: HttpCache):
+        os.makedirs(cache._path("bodies"), exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(prefix=".body-", suffix=".tmp", dir=cache._path("bodies"))
+        os.close(fd)
+        self.cache = cache
+        self.sha1, self.size, self.head = hashlib.sha1(), 0, b""
+
+    def read(self, r, limit: int = None) -> bool:
+        """
+        Copia el cuerpo de `r` (desde el principio, si es un reintento). Con
+        `limit`, para en cuanto hay esos bytes y devuelve True si ha cortado.
+        El presupuesto se mira entre trozo y trozo: el timeout de _get vale
+        para cada lectura del socket, no para el cuerpo entero.
+        """
+        self.sha1, self.size, self.head = hashlib.sha1(), 0, b""
+        cut, size = False, min(BODY_CHUNK, limit or BODY_CHUNK)
+        with open(self.tmp, "wb") as f:
+            for chunk in _iter_arriving(r, size):
+                if remaining() <= 0:
+                    raise SourceUnavailable(f"sin tiempo: presupuesto de {DEADLINE:.0f}s agotado")
+                self.sha1.update(chunk)
+                f.write(chunk)
+                self.size += len(chunk)
+                if len(self.head) < 1024:
+                    self.head += chunk[:1024 - len(self.head)]
+                if limit is not None and self.size >= limit:
+                    cut = True
+                    break
+        _count_bytes(r, self.size)
+        return cut
+
+    def commit(self) -> str:
+        version = self.sha1.hexdigest()
+        if os.path.exists(self.cache.body_path(version)):
+            self.discard()
+        else:
+            os.replace(self.tmp, self.cache.body_path(version))
+        return version
+
+    def discard(self):
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+def _iter_arriving(r, size: int):
+    """
+    Trozos de hasta `size` bytes del cuerpo de `r` según llegan. iter_content
+    espera a juntar `size` bytes, así que un servidor que suelta el cuerpo
+    gota a gota no volvería a tiempo de mirar el presupuesto; read1 (urllib3
+    2) vuelve tras una sola lectura. Los errores se traducen como en
+    iter_content, para que _get los reintente igual.
+    """
+    read1 = getattr(r.raw, "read1", None)
+    if read1 is None:
+        yield from r.iter_content(size)
+        return
+    requests = _requests()
+    from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError
+    try:
+        while True:
+            chunk = read1(size, decode_content=True)
+            if not chunk:
+                return
+            yield chunk
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e) from e
+    except DecodeError as e:
+        raise requests.exceptions.ContentDecodingError(e) from e
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e) from e
+
+# -------------- codificación --------------
+
+XML_ENCODING_RE = re.compile(rb"""<\?xml[^>]*\bencoding=["']([A-Za-z0-9._-]+)["']""")
+CHARSET_RE = re.compile(r"""charset\s*=\s*["']?([A-Za-z0-9._:-]+)""", re.IGNORECASE)
+BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+def sniff_encoding(head: bytes, content_type: str = "") -> str:
+    """
+    Codificación de un feed a partir de sus primeros bytes, sin la detección
+    de requests (que recorre el cuerpo entero): BOM, charset explícito de
+    Content-Type, declaración XML y, si no hay nada, UTF-8. El ISO-8859-1 que
+    requests supone para text/* sin charset no cuenta.
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    candidates = []
+    m = CHARSET_RE.search(content_type or "")
+    if m:
+        candidates.append(m.group(1))
+    m = XML_ENCODING_RE.match(head[:200])
+    if m:
+        candidates.append(m.group(1).decode("ascii"))
+    for encoding in candidates:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+PERMANENT_REDIRECTS = (301, 308)
+
+def _requests():
+    # requests tarda ~0,1 s en importarse; solo se carga si se descarga algo
+    import requests
+    return requests
+
+# -------------- sesión HTTP compartida --------------
+
+_session = None
+_session_lock = threading.Lock()
+
+def session():
+    """
+    Sesión de requests para todas las descargas: keep-alive y un pool de
+    conexiones por host del tamaño de la concurrencia máxima. Accept-Encoding
+    es el de urllib3, que añade br (y zstd) solo si puede descomprimirlos.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            requests = _requests()
+            from urllib3.util.request import ACCEPT_ENCODING
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=64, pool_maxsize=max(MAX_WORKERS, PER_HOST, *HOST_LIMITS.values()))
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update({"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING})
+            _session = s
+        return _session
+
+def connection_stats() -> dict:
+    """Peticiones y conexiones abiertas por la sesión (las demás, reutilizadas)."""
+    n_requests = n_connections = 0
+    if _session is not None:
+        for adapter in {id(a): a for a in _session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                n_requests += pool.num_requests
+                n_connections += pool.num_connections
+    return {"requests": n_requests, "connections": n_connections,
+            "reused": max(0, n_requests - n_connections)}
+
+def _count_bytes(r, body: int = None):
+    if body is None:
+        body = len(r.content)
+    try:
+        wire = r.raw.tell()
+    except (AttributeError, OSError):
+        wire = body
+    http_cache().count("wire_bytes", wire)
+    http_cache().count("body_bytes", body)
+    tracing.add("wire_bytes", wire)
+
+# -------------- presupuesto, reintentos y cortocircuito --------------
+
+DEADLINE = float(os.environ.get("FEEDBUENO_DEADLINE", "300"))
+RETRIES = int(os.environ.get("FEEDBUENO_RETRIES", "2"))
+BACKOFF = 1.0   # segundos; tope de la espera aleatoria, se dobla en cada reintento
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+BREAKER_AFTER = int(os.environ.get("FEEDBUENO_BREAKER_AFTER", "2"))
+BREAKER_BASE = float(os.environ.get("FEEDBUENO_BREAKER_HOURS", "6")) * 3600
+BREAKER_MAX = 7 * 86400
+PROBE_TIMEOUT = 5
+HEAD_KB = int(os.environ.get("FEEDBUENO_HEAD_KB", "0"))
+HEDGE_PCT = float(os.environ.get("FEEDBUENO_HEDGE_PCT", "90"))
+HEDGE_AFTER = float(os.environ.get("FEEDBUENO_HEDGE_AFTER", "2"))
+HEDGE_MIN_SAMPLES = 5
+LATENCY_SAMPLES = 50
+
+class SourceUnavailable(Exception):
+    """No se ha pedido la fuente: cortocircuito abierto o presupuesto agotado."""
+
+_run_start = time.monotonic()
+
+def remaining() -> float:
+    """Segundos que quedan del presupuesto de descargas de la ejecución."""
+    if DEADLINE <= 0:
+        return float("inf")
+    return DEADLINE - (time.monotonic() - _run_start)
+
+def _transient(e: Exception) -> bool:
+    requests = _requests()
+    # un timeout ya ha gastado TIMEOUT segundos; repetirlo suele costar otros tantos
+    if isinstance(e, requests.Timeout):
+        return False
+    if isinstance(e, requests.ConnectionError):
+        return True
+    response = getattr(e, "response", None)
+    return response is not None and response.status_code in RETRY_STATUS
+
+def _get(url: str, headers: dict, probe: bool = False, stream: bool = False, sink=None):
+    """
+    GET con reintentos (espera aleatoria entre 0 y BACKOFF·2^n) para errores
+    transitorios. Ni empieza un intento ni espera más allá del presupuesto;
+    en modo sonda hace un único intento de PROBE_TIMEOUT segundos. Con
+    `stream` el cuerpo queda sin leer (y sin contar) para quien llama; con
+    `sink`, el cuerpo de un 200 se le pasa a sink(r) dentro del intento (un
+    corte a medias se reintenta) y sin cargarlo en memoria.
+    """
+    requests = _requests()
+    attempts = 1 if probe else 1 + max(0, RETRIES)
+    nominal = min(PROBE_TIMEOUT, TIMEOUT) if probe else TIMEOUT
+    for attempt in range(attempts):
+        left = remaining()
+        if left <= 0:
+            raise SourceUnavailable(f"sin tiempo: presupuesto de {DEADLINE:.0f}s agotado")
+        timeout = min(nominal, left)
+        try:
+            host = host_of(url)
+            _throttle(host)
+            with _host_semaphore(host):
+                r = session().get(url, timeout=timeout, headers=headers, stream=stream or sink is not None)
+                if sink is not None and r.status_code == 200:
+                    with r:
+                        sink(r)
+                elif not stream:
+                    _count_bytes(r)
+            if stream and not r.ok:
+                r.close()
+            r.raise_for_status()
+            http_cache().observe(host, r.elapsed.total_seconds())
+            return r
+        except requests.RequestException as e:
+            if isinstance(e, requests.Timeout) and timeout < nominal:
+                raise SourceUnavailable(f"sin tiempo: presupuesto de {DEADLINE:.0f}s agotado") from e
+            if attempt + 1 >= attempts or not _transient(e):
+                raise
+            delay = random.uniform(0, BACKOFF * 2 ** attempt)
+            if delay >= remaining():
+                raise
+            http_cache().count("retries")
+            tracing.add("retries")
+            time.sleep(delay)
+
+MIRROR_SEP = "|"
+
+def mirrors(source: str) -> list:
+    """URLs de una línea de source.txt: una sola, o varios espejos separados por "|"."""
+    return [u.strip() for u in source.split(MIRROR_SEP) if u.strip()]
+
+def download(url: str, full: bool = False) -> Fetched:
+    """
+    `url` es una línea de source.txt (con sus espejos, si los hay); `full`:
+    la fuente entera aunque haya FEEDBUENO_HEAD_KB.
+    """
+    with tracing.span("fetch", url=url):
+        cache = http_cache()
+        spooled = cache.spool_read(url)
+        if spooled is not None and not (full and spooled.partial):
+            cache.count("spooled")
+            tracing.add("spooled")
+            return spooled
+        urls = mirrors(url)
+        if len(urls) > 1:
+            fetched = _hedged(url, urls, cache, full)
+        else:
+            fetched = _download_checked(urls[0] if urls else url, cache, full)
+        cache.spool_write(url, fetched)
+        return fetched
+
+def _download_checked(url: str, cache: HttpCache, full: bool = False) -> Fetched:
+    """_download de una URL pasando por su cortocircuito."""
+    circuit = cache.circuit(url)
+    if circuit == "open":
+        cache.count("open")
+        tracing.add("circuit_open")
+        raise SourceUnavailable("saltada: ha fallado en las últimas ejecuciones")
+    try:
+        fetched = _download(url, cache, probe=circuit == "probe", full=full)
+    except SourceUnavailable:
+        cache.count("no_time")
+        raise
+    except Exception as e:
+        cache.record_failure(url, e)
+        raise
+    cache.record_success(url)
+    return fetched
+
+def _hedged(source: str, urls: list, cache: HttpCache, full: bool = False) -> Fetched:
+    """
+    Pide los espejos de `source` escalonados: el siguiente sale cuando el
+    anterior falla o tarda más que su hedge_delay. Devuelve la primera
+    respuesta buena con el nombre de la fuente. Las que llegan después no se
+    esperan (requests no deja cortar una petición en marcha): acaban en su
+    hilo, dentro de su timeout, y solo actualizan la caché de su espejo.
+    """
+    results = queue.Queue()
+
+    def attempt(u: str):
+        try:
+            results.put((u, _download_checked(u, cache, full), None))
+        except Exception as e:
+            results.put((u, None, e))
+
+    pending, errors, waiting = 0, [], None
+    todo = list(urls)
+    while True:
+        if todo and waiting is None:
+            waiting = todo.pop(0)
+            threading.Thread(target=attempt, args=(waiting,), name="mirror", daemon=True).start()
+            pending += 1
+            if waiting != urls[0]:
+                tracing.add("mirror_requests")
+        if not pending:
+            raise errors[0]
+        try:
+            u, fetched, error = results.get(timeout=cache.hedge_delay(host_of(waiting)) if todo else None)
+        except queue.Empty:
+            cache.count("hedged")
+            waiting = None      # el anterior sigue en marcha; sale el siguiente
+            continue
+        pending -= 1
+        if error is None:
+            if u != urls[0]:
+                cache.count("mirror_wins")
+                tracing.add("mirror_win")
+            fetched.url = source
+            return fetched
+        errors.append(error)
+        if u == waiting:
+            waiting = None
+
+def _download(url: str, cache: HttpCache, probe: bool = False, full: bool = False) -> Fetched:
+    with cache.lock:
+        entry = dict(cache.entries.get(url) or {})
+    target = entry.get("redirect") or url
+    head = HEAD_KB > 0 and not full
+    headers = {}
+    cached = cache.cached(url, entry) if entry else None
+    # un 304 devolvería lo guardado: no vale si se pide entera y solo hay la cabeza
+    if cached is not None and (head or not cached.partial):
+        if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+    if head:
+        headers["Range"] = f"bytes=0-{HEAD_KB * 1024 - 1}"
+
+    # el cuerpo va directo a la caché mientras llega, nunca entero en memoria
+    body = BodyFile(cache)
+    try:
+        try:
+            r = _get(target, headers, probe, stream=head, sink=None if head else body.read)
+        except _requests().RequestException:
+            if target == url:
+                raise
+            # la redirección recordada ha dejado de funcionar: volver a la original
+            with cache.lock:
+                cache.entries.pop(url, None)
+            return _download(url, cache, probe, full)
+        if target != url:
+            cache.count("redirects")
+
+        if r.status_code == 304 and cached is not None:
+            r.close()
+            cache.count("hits")
+            tracing.add("not_modified")
+            return cached
+
+        cache.count("misses")
+        final_url = target
+        if r.history and all(h.status_code in PERMANENT_REDIRECTS for h in r.history):
+            final_url = r.url
+        partial = False
+        if head:
+            with r:
+                partial = _read_head(r, body)
+            if partial:
+                cache.count("heads")
+                tracing.add("head")
+        if full and HEAD_KB > 0:
+            # sin cabezas todas las descargas son enteras; no hay nada que contar
+            cache.count("head_full")
+            tracing.add("head_full")
+        tracing.add("bytes", body.size)
+        encoding = sniff_encoding(body.head, r.headers.get("Content-Type", ""))
+        version = cache.store(url, final_url, r, body, encoding, partial)
+        return Fetched(url, version, encoding, cache.body_path(version), partial=partial)
+    finally:
+        body.discard()
+
+CONTENT_RANGE_RE = re.compile(r"bytes\s+\d+-(\d+)/(\d+|\*)", re.IGNORECASE)
+
+def _read_head(r, body: BodyFile) -> bool:
+    """
+    Lee a `body` el cuerpo de una petición con Range; True si se ha quedado a
+    medias. Un 206 se lee entero (ya viene recortado); un 200 de un servidor
+    que ignora Range se corta en cuanto hay HEAD_KB y se cierra la conexión.
+    """
+    if r.status_code == 206:
+        m = CONTENT_RANGE_RE.match(r.headers.get("Content-Range", ""))
+        complete = m is not None and m.group(2) != "*" and int(m.group(1)) + 1 >= int(m.group(2))
+        body.read(r)
+        return not complete
+    return body.read(r, HEAD_KB * 1024)
+
+# -------------- estado por feed destino --------------
+
+def source_unchanged(consumer: str, feed_sig: str, src: Fetched) -> bool:
+    """
+    True si `consumer` (un feed destino, con su filtro) ya procesó esta misma
+    versión de la fuente y el feed no ha cambiado desde entonces.
+    """
+    cache = http_cache()
+    with cache.lock:
+        state = cache.seen.get(consumer) or {}
+    if state.get("feed") == feed_sig and (state.get("sources") or {}).get(src.url) == src.version:
+        cache.count("skipped")
+        return True
+    return False
+
+def watermark(consumer: str, url: str):
+    """Clave del ítem más reciente de `url` que vio `consumer` la última vez."""
+    cache = http_cache()
+    with cache.lock:
+        return ((cache.seen.get(consumer) or {}).get("marks") or {}).get(url)
+
+def mark_processed(consumer: str, feed_sig: str, versions: dict, marks: dict = None):
+    """
+    Recuerda qué versión de cada fuente está ya volcada en el feed, cuya
+    firma (feed_index.file_digest) es `feed_sig`.
+    """
+    state = {"feed": feed_sig, "sources": dict(versions)}
+    if marks:
+        state["marks"] = {url: key for url, key in marks.items() if key}
+    cache = http_cache()
+    with cache.lock:
+        cache.seen[consumer] = state
+
+def reset_run():
+    """Olvida descargas, caché cargada y presupuesto (para benchmarks o varias pasadas)."""
+    global _cache, _run_start
+    with _pending_lock:
+        _pending.clear()
+    with _cache_lock:
+        _cache = None
+    _run_start = time.monotonic()
+
+def finish_run():
+    """Guarda la caché en disco e imprime el resumen de aciertos/fallos."""
+    if _cache is None:
+        return
+    _cache.save()
+    print(_cache.report())
+
+# -------------- precarga concurrente --------------
+
+# una Future por URL y ejecución: nadie descarga dos veces la misma fuente
+_pending = {}
+_pending_lock = threading.Lock()
+
+def _key(url: str, full: bool):
+    return ("full", url) if full and HEAD_KB > 0 else url
+
+def prefetch(urls, max_workers: int = None, full: bool = False) -> int:
+    """
+    Lanza en segundo plano la descarga de cada URL distinta de `urls`.
+    fetch() (o fetch_full(), con `full`) recoge después el resultado (o la
+    excepción) de cada una. Devuelve cuántas descargas nuevas se han lanzado.
+    """
+    with _pending_lock:
+        todo = []
+        for url in urls:
+            if url and _key(url, full) not in _pending and url not in todo:
+                todo.append(url)
+        if not todo:
+            return 0
+        pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers or MAX_WORKERS, len(todo))),
+                                  thread_name_prefix="fetch")
+        for url in todo:
+            _pending[_key(url, full)] = pool.submit(download, url, full)
+    pool.shutdown(wait=False)
+    return len(todo)
+
+def _once(key, url: str, full: bool = False) -> Fetched:
+    with _pending_lock:
+        future = _pending.get(key)
+        owner = future is None
+        if owner:
+            future = _pending[key] = Future()
+    if owner:
+        try:
+            future.set_result(download(url, full))
+        except BaseException as e:
+            future.set_exception(e)
+    return future.result()
+
+def fetch(url: str) -> Fetched:
+    """Devuelve la fuente `url`, esperando a la precarga si la hay."""
+    return _once(url, url)
+
+def fetch_full(url: str) -> Fetched:
+    """
+    Como fetch(), pero la fuente entera: aprovecha lo que ya se haya bajado
+    (o se esté bajando) de `url` y solo vuelve a pedirla si era la cabeza.
+    """
+    with _pending_lock:
+        head_pending = url in _pending and _key(url, True) not in _pending
+    if head_pending or HEAD_KB <= 0:
+        src = fetch(url)
+        if not src.partial:
+            return src
+    return _once(_key(url, True), url, full=True)
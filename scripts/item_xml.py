@@ -0,0 +1,166 @@
+# scripts/item_xml.py
+
+"""
+Edición estructurada de un <item> RSS.
+
+ItemXml trocea el ítem una sola vez en sus hijos directos (un hijo acaba en
+el primer cierre con su nombre, como con las regex de antes; un '>' dentro
+de un atributo entrecomillado no corta la etiqueta) y permite reemplazar,
+añadir o cambiar atributos de esos hijos sin volver a pasar regex por el
+ítem entero. Todo lo que no se toca (elementos desconocidos, espacios,
+prefijos de namespace) se conserva byte a byte al serializar.
+
+Si el ítem no se puede trocear (XML roto, CDATA sin cerrar...) `ok` queda a
+False y los mismos métodos trabajan con regex sobre el texto entero, como
+se hacía antes; cada una de esas pasadas suma al contador regex_passes.
+"""
+
+import re
+
+import tracing
+
+# etiqueta de apertura/cierre; las comillas se saltan enteras para que un '>'
+# dentro de un atributo no la corte
+TAG_RE = re.compile(r"""<(/?)([^\s/>!?]+)(?:"[^"]*"|'[^']*'|[^'">])*>""")
+# espacio y un hijo directo entero: autocerrado, o apertura hasta el primer
+# cierre con el mismo nombre (como hacían las regex de antes); CDATA y
+# comentarios sueltos también cuentan como hijo
+CHILD_RE = re.compile(
+    r"""(\s*)(<([^\s/>!?]+)[^'">]*(?:(?:"[^"]*"|'[^']*')[^'">]*)*(?:(?<=/)>|>.*?</\3\s*>)"""
+    r"""|<!\[CDATA\[.*?\]\]>|<!--.*?-->)""",
+    flags=re.DOTALL
+)
+
+class ItemXml:
+    __slots__ = ("parts", "index", "ok")
+
+    def __init__(self, xml: str):
+        # parts: [apertura, hueco, hijo, hueco, hijo, ..., hueco, cierre]
+        # index: nombre en minúsculas -> posiciones en parts de esos hijos
+        self.parts, self.index, self.ok = [xml], {}, False
+        self._parse(xml)
+
+    def _parse(self, xml: str):
+        if xml.count("<![CDATA[") != xml.count("]]>"):
+            return
+        m = TAG_RE.match(xml)
+        close = xml.rfind("</")
+        if not m or m.group(1) or m.group(2).lower() != "item" or xml[m.end() - 2] == "/" \
+                or xml[close:].rstrip().lower() != "</item>":
+            return
+        parts, index = [xml[:m.end()]], {}
+        pos, match = m.end(), CHILD_RE.match
+        while True:
+            c = match(xml, pos, close)
+            if c is None:
+                break
+            gap, child, name = c.group(1, 2, 3)
+            parts += (gap, child)
+            if name:
+                index.setdefault(name.lower(), []).append(len(parts) - 1)
+            pos = c.end()
+        # lo que queda hasta </item> tiene que ser solo espacio; si no, hay
+        # texto suelto o algo que no se ha podido emparejar
+        rest = xml[pos:close]
+        if rest.strip():
+            return
+        parts += (rest, xml[close:])
+        self.parts, self.index, self.ok = parts, index, True
+
+    def __str__(self) -> str:
+        return "".join(self.parts)
+
+    def has(self, name: str) -> bool:
+        if not self.ok:
+            tracing.add("regex_passes")
+            return re.search(r"<%s\b" % re.escape(name), self.parts[0], flags=re.IGNORECASE) is not None
+        return name.lower() in self.index
+
+    def get(self, name: str):
+        """XML completo del primer hijo `name`, o None."""
+        if not self.ok:
+            tracing.add("regex_passes")
+            m = _element_re(name).search(self.parts[0])
+            return m.group(0) if m else None
+        idx = self.index.get(name.lower())
+        return self.parts[idx[0]] if idx else None
+
+    def replace(self, name: str, child_xml: str) -> int:
+        """Sustituye todos los hijos `name` por `child_xml`; devuelve cuántos había."""
+        if not self.ok:
+            tracing.add("regex_passes")
+            self.parts[0], n = _element_re(name).subn(lambda m: child_xml, self.parts[0])
+            return n
+        idx = self.index.get(name.lower(), ())
+        for i in idx:
+            self.parts[i] = child_xml
+        return len(idx)
+
+    def append(self, child_xml: str):
+        """Añade `child_xml` y un salto de línea justo antes de </item>."""
+        if not self.ok:
+            tracing.add("regex_passes")
+            xml = self.parts[0]
+            close = xml.lower().rfind("</item>")
+            if close == -1:
+                close = len(xml)
+            self.parts[0] = xml[:close] + child_xml + "\n" + xml[close:]
+            return
+        # va justo antes del cierre, así que las posiciones anteriores no cambian
+        i = len(self.parts) - 1
+        self.parts.insert(i, child_xml + "\n")
+        name = _child_name(child_xml)
+        if name:
+            self.index.setdefault(name, []).append(i)
+
+    def set_or_append(self, name: str, child_xml: str):
+        if not self.replace(name, child_xml):
+            self.append(child_xml)
+
+    def attr(self, name: str, attr: str):
+        """Valor del atributo `attr` del primer hijo `name`, o None."""
+        child = self.get(name)
+        if child is None:
+            return None
+        tag = TAG_RE.match(child)
+        m = _attr_re(attr).search(tag.group(0)) if tag else None
+        return m.group(3) if m else None
+
+    def set_attr(self, name: str, attr: str, value: str) -> int:
+        """Cambia `attr` en la etiqueta de apertura de todos los hijos `name` que lo tienen."""
+        pattern, changed = _attr_re(attr), 0
+        if not self.ok:
+            tracing.add("regex_passes")
+            def set_in_tag(m):
+                nonlocal changed
+                tag, n = pattern.subn(lambda a: a.group(1) + value + a.group(2), m.group(0), count=1)
+                changed += n
+                return tag
+            self.parts[0] = re.sub(r"<%s\b[^>]*>" % re.escape(name), set_in_tag, self.parts[0], flags=re.IGNORECASE)
+            return changed
+        for i in self.index.get(name.lower(), ()):
+            child = self.parts[i]
+            tag_end = TAG_RE.match(child).end()
+            tag, n = pattern.subn(lambda m: m.group(1) + value + m.group(2), child[:tag_end], count=1)
+            if n:
+                self.parts[i] = tag + child[tag_end:]
+                changed += 1
+        return changed
+
+def _child_name(child_xml: str):
+    m = TAG_RE.match(child_xml)
+    return m.group(2).lower() if m else None
+
+def _element_re(name: str):
+    name = re.escape(name)
+    return re.compile(r"<%s\b[^>]*/>|<%s\b[^>]*>.*?</%s>" % (name, name, name), flags=re.IGNORECASE | re.DOTALL)
+
+_attr_res = {}
+
+def _attr_re(attr: str):
+    # grupos: 1 = ' attr="', 2 = comilla, 3 = valor
+    pattern = _attr_res.get(attr)
+    if pattern is None:
+        pattern = _attr_res[attr] = re.compile(
+            r"""(\s%s\s*=\s*(["']))(.*?)\2""" % re.escape(attr), flags=re.IGNORECASE | re.DOTALL)
+    return pattern
@@ -2,13 +2,20 @@
 from pathlib import Path
 from lxml import etree
 
+import tracing
+
 BASE_DIR = Path(__file__).resolve().parent.parent / "public"
 
 def refresh_feed(feed0_path: Path, feed_path: Path):
+    with tracing.span("refresh", feed=str(feed_path)):
+        _refresh_feed(feed0_path, feed_path)
+
+def _refresh_feed(feed0_path: Path, feed_path: Path):
     parser = etree.XMLParser(remove_blank_text=True)
 
-    feed0_tree = etree.parse(str(feed0_path), parser)
-    feed_tree = etree.parse(str(feed_path), parser)
+    with tracing.stage("parse"):
+        feed0_tree = etree.parse(str(feed0_path), parser)
+        feed_tree = etree.parse(str(feed_path), parser)
 
     feed0_root = feed0_tree.getroot()
     feed_root = feed_tree.getroot()
@@ -42,11 +49,16 @@ def refresh_feed(feed0_path: Path, feed_path: Path):
                 channel.append(child0)
 
     # Guardar respetando la declaración XML
-    feed_tree.write(str(feed_path), encoding="utf-8", xml_declaration=True, pretty_print=True)
+    with tracing.stage("write"):
+        feed_tree.write(str(feed_path), encoding="utf-8", xml_declaration=True, pretty_print=True)
 
 def main():
-    for podcast_dir in BASE_DIR.iterdir():
-        if not podcast_dir.is_dir():
+    with tracing.run("refresh_podcast_feeds"):
+        refresh_all()
+
+def refresh_all(base_dir: Path = BASE_DIR, only=None):
+    for podcast_dir in Path(base_dir).iterdir():
+        if not podcast_dir.is_dir() or (only and podcast_dir.name not in only):
             continue
 
         feed0 = podcast_dir / "feed0.xml"
@@ -0,0 +1,122 @@
+# scripts/render_cache.py
+
+"""
+Caché de ítems ya renderizados, direccionada por contenido.
+
+El mismo episodio de ivoox acaba en varios feeds destino (imetal, imetal2,
+imario...) y renderizarlo (process_description_block + replace_description)
+da siempre lo mismo para las mismas entradas. La clave es un hash de esas
+entradas más la versión de las transformaciones, así que subir la versión
+invalida todo sin tener que borrar nada.
+
+- FEEDBUENO_RENDER_CACHE: "disk" (por defecto; en <FEEDBUENO_CACHE_DIR>/render),
+  "memory" (solo durante la ejecución) u "off".
+- FEEDBUENO_RENDER_CACHE_SIZE: entradas en memoria (LRU), 2048 por defecto.
+
+En disco cada entrada es un fichero; las que no se usan en TTL_DAYS días se
+borran la primera vez que se escribe en la caché en cada ejecución.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+MODE = os.environ.get("FEEDBUENO_RENDER_CACHE", "disk").strip().lower()
+MAX_ENTRIES = int(os.environ.get("FEEDBUENO_RENDER_CACHE_SIZE", "2048"))
+TTL_DAYS = 30
+
+def render_key(*parts) -> str:
+    h = hashlib.sha1()
+    for part in parts:
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+class RenderCache:
+    def __init__(self, directory: str = None, max_entries: int = MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max(1, max_entries)
+        self.memory = OrderedDict()
+        self.hits = self.misses = 0
+        self._pruned = False
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".xml")
+
+    def _remember(self, key: str, value: str):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return value
+        if self.directory:
+            path = self._path(key)
+            try:
+                # newline="" para no tocar los \r\n que traiga el ítem
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    value = f.read()
+                os.utime(path)
+            except OSError:
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: str):
+        self._remember(key, value)
+        if not self.directory:
+            return
+        if not self._pruned:
+            self._pruned = True
+            self.prune()
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with open(fd, "w", encoding="utf-8", newline="") as f:
+                f.write(value)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️  No se pudo guardar el render en caché: {e}")
+
+    def prune(self, ttl_days: int = TTL_DAYS) -> int:
+        """Borra las entradas de disco sin usar en `ttl_days` días."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        limit, removed = time.time() - ttl_days * 86400, 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < limit:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+_shared = None
+
+def shared(cache_dir: str):
+    """Caché de la ejecución (None si FEEDBUENO_RENDER_CACHE=off)."""
+    global _shared
+    if MODE == "off":
+        return None
+    if _shared is None:
+        _shared = RenderCache(os.path.join(cache_dir, "render") if MODE == "disk" else None)
+    return _shared
+
+def reset():
+    global _shared
+    _shared = None
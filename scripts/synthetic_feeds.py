@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+scripts/synthetic_feeds.py
+
+Generador de feeds sintéticos al estilo de los de ivoox que consumimos
+(RSS + iTunes, descripciones con CDATA o HTML escapado, listas, enlaces e
+imágenes) y servidor HTTP local que los sirve con latencia, tasa de errores
+y comportamiento de ETag configurables.
+
+Con ambos se monta una prueba de carga sin red: crea N carpetas con feed.xml
+y source.txt apuntando al servidor, ejecuta los updaters y mide ítems/s,
+feeds/s y pico de memoria para cada tamaño: el de tracemalloc (solo objetos
+Python, se reinicia en cada medida) y el RSS máximo del proceso, que es
+acumulado pero incluye lo que reserva lxml.
+
+Cada medida son dos pasadas: en frío (caché HTTP vacía) y en tibio, otra vez
+sobre los feeds ya actualizados y con la caché que guardó la primera, que es
+donde se nota --etag (304, o descargas enteras con "none" y "unstable").
+
+Uso:
+  python scripts/synthetic_feeds.py --feeds 50 --items 100 1000 --mode all
+  python scripts/synthetic_feeds.py --feeds 20 --items 500 --latency 0.2 --error-rate 0.1
+"""
+import argparse
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import os
+import random
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from email.utils import formatdate
+
+# la caché HTTP de la prueba no debe tocar la del repo
+os.environ.setdefault("FEEDBUENO_CACHE_DIR", tempfile.mkdtemp(prefix="feedbueno-load-cache-"))
+# contra el servidor local no tiene sentido el límite de ritmo por host
+os.environ.setdefault("FEEDBUENO_RATE", "0")
+
+import tracing
+
+WORDS = (
+    "episodio podcast juego videojuegos tertulia análisis noticias consola remake saga "
+    "historia entrevista invitado capítulo temporada retro nintendo sony xbox metal gear "
+    "mario souls comunidad directo programa opinión lanzamiento"
+).split()
+
+# -------------- generador --------------
+
+def _sentence(rnd: random.Random, n: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+def make_description(rnd: random.Random, size: int, list_ratio: float, image_ratio: float) -> str:
+    """Cuerpo HTML de una descripción de unos `size` caracteres."""
+    parts = []
+    while sum(len(p) for p in parts) < size:
+        r = rnd.random()
+        if r < list_ratio:
+            if rnd.random() < 0.5:
+                parts.append("<br>".join(f"{i}. {_sentence(rnd, 4)}" for i in range(1, rnd.randint(3, 6))))
+            else:
+                parts.append("<br>".join(f"- {_sentence(rnd, 4)}" for _ in range(rnd.randint(2, 5))))
+        elif r < list_ratio + image_ratio:
+            parts.append(f"https://img.example.com/{rnd.randrange(10**6)}.jpg")
+        elif r < list_ratio + image_ratio + 0.15:
+            parts.append(f"Web: https://www.example.com/{rnd.choice(WORDS)} Contacto: hola@example.com")
+        else:
+            parts.append(f"<p>{_sentence(rnd, rnd.randint(8, 20))}</p>")
+    return "\n".join(parts)
+
+def make_item(rnd: random.Random, show: int, n: int, desc_size: int, cdata_ratio: float,
+              list_ratio: float, image_ratio: float) -> str:
+    audio_id = show * 100000 + n
+    season, episode = 1 + n // 50, 1 + n % 50
+    desc = make_description(rnd, desc_size, list_ratio, image_ratio)
+    if rnd.random() < cdata_ratio:
+        desc_xml = f"<![CDATA[{desc}]]>"
+    else:
+        desc_xml = desc.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return (
+        "<item>\n"
+        f"<title><![CDATA[Show {show} {season}x{episode:02d} | {_sentence(rnd, 5)}]]></title>\n"
+        f"<link>https://www.ivoox.com/show-{show}-{n}-audios-mp3_rf_{audio_id}_1.html</link>\n"
+        f"<description>{desc_xml}</description>\n"
+        f"<pubDate>{formatdate(1_700_000_000 + n * 86400)}</pubDate>\n"
+        f"<guid>https://www.ivoox.com/{audio_id}</guid>\n"
+        f'<enclosure url="https://www.ivoox.com/show_mf_{audio_id}_feed_1.mp3" type="audio/mpeg" length="{rnd.randrange(10**7, 10**8)}"/>\n'
+        f"<itunes:season>{season}</itunes:season>\n"
+        f"<itunes:episode>{episode}</itunes:episode>\n"
+        f'<itunes:image href="https://static-1.ivoox.com/audios/{audio_id}_XXL.jpg"/>\n'
+        "</item>"
+    )
+
+def make_feed(show: int, n_items: int, desc_size: int = 800, cdata_ratio: float = 0.7,
+              list_ratio: float = 0.15, image_ratio: float = 0.1, seed: int = 0,
+              skip_newest: int = 0, op3: str = "") -> str:
+    """
+    Feed RSS completo de `n_items` episodios, del más nuevo al más antiguo.
+    Con `skip_newest` se omiten los más recientes (feed destino "atrasado").
+    """
+    rnd = random.Random(f"{seed}-{show}")
+    items = [make_item(rnd, show, n, desc_size, cdata_ratio, list_ratio, image_ratio)
+             for n in range(n_items, 0, -1)]
+    head = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" '
+        'xmlns:atom="http://www.w3.org/2005/Atom" xmlns:media="http://search.yahoo.com/mrss/">\n'
+        "<channel>\n"
+        f"<title><![CDATA[Show {show}]]></title>\n"
+        f"<link>https://www.ivoox.com/podcast-show-{show}_sq_f1{show}_1.html</link>\n"
+        f"<description><![CDATA[{_sentence(rnd, 25)}]]></description>\n"
+        f'<atom:link href="https://feedbueno.es/show{show}/feed.xml" rel="self" type="application/rss+xml"/>\n'
+        f'<itunes:image href="https://static-1.ivoox.com/canales/show{show}_XXL.jpg"/>\n'
+        f"<op3>{op3}</op3>\n"
+    )
+    return head + "\n".join(items[skip_newest:]) + "\n</channel>\n</rss>\n"
+
+# -------------- servidor --------------
+
+class SourceServer:
+    """
+    Sirve feeds en memoria en /<nombre>.xml.
+    etag: "strong" (ETag estable y 304), "none" (sin validadores) o
+    "unstable" (ETag distinto en cada respuesta, como algunos CDN).
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, etag: str = "strong", seed: int = 0):
+        self.feeds = {}
+        self.latency, self.error_rate, self.etag = latency, error_rate, etag
+        self.stats = {"requests": 0, "errors": 0, "not_modified": 0, "bytes": 0}
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def add(self, name: str, xml: str):
+        body = xml.encode("utf-8")
+        self.feeds[name] = (body, '"' + hashlib.sha1(body).hexdigest()[:16] + '"')
+
+    def _handler(self):
+        outer = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with outer._lock:
+                    outer.stats["requests"] += 1
+                    fail = outer._rnd.random() < outer.error_rate
+                if outer.latency:
+                    time.sleep(outer.latency)
+                feed = outer.feeds.get(self.path.lstrip("/").rsplit(".xml", 1)[0])
+                if fail or feed is None:
+                    with outer._lock:
+                        outer.stats["errors"] += 1
+                    self.send_response(503 if fail else 404)
+                    self.end_headers()
+                    return
+                body, etag = feed
+                if outer.etag == "unstable":
+                    etag = f'"{time.time_ns()}"'
+                if outer.etag != "none" and self.headers.get("If-None-Match") == etag:
+                    with outer._lock:
+                        outer.stats["not_modified"] += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                if outer.etag != "none":
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+                with outer._lock:
+                    outer.stats["bytes"] += len(body)
+
+        return Handler
+
+    def start(self) -> str:
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+# -------------- prueba de carga --------------
+
+def max_rss_mb() -> float:
+    """Pico de memoria residente del proceso (incluye lxml, que tracemalloc no ve)."""
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if os.uname().sysname == "Darwin" else 2**10), 1)
+
+def build_workspace(work: str, server: SourceServer, base_url: str, feeds: int, items: int,
+                    new: int, args) -> list:
+    dirs = []
+    for show in range(1, feeds + 1):
+        kw = dict(desc_size=args.desc_size, cdata_ratio=args.cdata_ratio,
+                  list_ratio=args.list_ratio, image_ratio=args.image_ratio, seed=args.seed)
+        server.add(f"show{show}", make_feed(show, items, **kw))
+        path = os.path.join(work, "public", f"show{show}")
+        os.makedirs(path)
+        dest = make_feed(show, items, skip_newest=new, **kw)
+        with open(os.path.join(path, "feed.xml"), "w", encoding="utf-8") as f:
+            f.write(dest)
+        with open(os.path.join(path, "feed0.xml"), "w", encoding="utf-8") as f:
+            f.write(make_feed(show, 0, **kw))
+        for name in ("source.txt", "imagen.txt"):
+            with open(os.path.join(path, name), "w", encoding="utf-8") as f:
+                f.write(f"{base_url}/show{show}.xml\n")
+        dirs.append(path)
+    return dirs
+
+def run_mode(mode: str, dirs: list):
+    import update_feeds as uf
+    if mode == "update":
+        urls = [u for d in dirs for u in uf.read_source_urls(os.path.join(d, "source.txt"))]
+        uf.expect_readers(urls)
+        uf.fetcher.prefetch(urls)
+        for d in dirs:
+            uf.update_feed_dir(d)
+    elif mode == "with-image":
+        import update_feeds_with_image as ufi
+        urls = [u for d in dirs for u in uf.read_source_urls(os.path.join(d, "imagen.txt"))]
+        uf.expect_readers(urls)
+        uf.fetcher.prefetch(urls)
+        for d in dirs:
+            ufi.update_feed_dir_with_image(d)
+    elif mode == "refresh":
+        from pathlib import Path
+        import refresh_podcast_feeds as rpf
+        for d in dirs:
+            rpf.refresh_feed(Path(d, "feed0.xml"), Path(d, "feed.xml"))
+
+def measure(mode: str, feeds: int, items: int, args) -> dict:
+    import update_feeds as uf
+    work = tempfile.mkdtemp(prefix="feedbueno-load-")
+    server = SourceServer(args.latency, args.error_rate, args.etag, args.seed)
+    base_url = server.start()
+    new = max(1, items * args.new_pct // 100)
+    try:
+        dirs = build_workspace(work, server, base_url, feeds, items, new, args)
+        uf.fetcher.CACHE_DIR = os.path.join(work, "cache")
+        uf.reset_run()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), tracing.span("load", mode=mode, feeds=feeds, items=items):
+            run_mode(mode, dirs)
+            uf.fetcher.finish_run()
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        cold_stats = dict(server.stats)
+
+        # segunda pasada: la caché HTTP se vuelve a cargar de disco
+        server.stats = dict.fromkeys(server.stats, 0)
+        uf.reset_run()
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), tracing.span("load_warm", mode=mode, feeds=feeds, items=items):
+            run_mode(mode, dirs)
+            uf.fetcher.finish_run()
+        warm = time.perf_counter() - t0
+    finally:
+        server.stop()
+        shutil.rmtree(work, ignore_errors=True)
+    processed = feeds * (items if mode == "refresh" else new)
+    return {
+        "mode": mode, "feeds": feeds, "items": items, "new_items": new,
+        "seconds": round(elapsed, 4),
+        "items_per_s": round(processed / elapsed, 1),
+        "feeds_per_s": round(feeds / elapsed, 2),
+        "peak_mb": round(peak / 2**20, 2),
+        "max_rss_mb": max_rss_mb(),
+        "server": cold_stats,
+        "warm_seconds": round(warm, 4),
+        "warm_feeds_per_s": round(feeds / warm, 2),
+        "warm_server": dict(server.stats),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga con feeds sintéticos.")
+    parser.add_argument("--feeds", type=int, default=20, help="Carpetas/feeds a generar.")
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 1000], help="Episodios por feed (uno o varios tamaños).")
+    parser.add_argument("--new-pct", type=int, default=10, help="Porcentaje de episodios nuevos en cada fuente.")
+    parser.add_argument("--desc-size", type=int, default=800, help="Caracteres aproximados por descripción.")
+    parser.add_argument("--cdata-ratio", type=float, default=0.7, help="Fracción de descripciones en CDATA.")
+    parser.add_argument("--list-ratio", type=float, default=0.15, help="Fracción de bloques que son listas.")
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="Fracción de bloques que son URLs de imagen.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia por petición en segundos.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilidad de responder 503.")
+    parser.add_argument("--etag", choices=["strong", "none", "unstable"], default="strong")
+    parser.add_argument("--mode", choices=["update", "with-image", "refresh", "all"], default="update")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    modes = ["update", "with-image", "refresh"] if args.mode == "all" else [args.mode]
+    results = []
+    print(f"{'modo':<12}{'feeds':>6}{'ítems':>7}{'s':>9}{'ítems/s':>10}{'feeds/s':>9}{'pico MB':>9}{'RSS MB':>9}"
+          f"{'s tibio':>9}{'304':>6}{'KB tibio':>10}")
+    with tracing.run("synthetic_feeds"):
+        for items in args.items:
+            for mode in modes:
+                r = measure(mode, args.feeds, items, args)
+                results.append(r)
+                print(f"{mode:<12}{r['feeds']:>6}{r['items']:>7}{r['seconds']:>9.3f}"
+                      f"{r['items_per_s']:>10.1f}{r['feeds_per_s']:>9.2f}{r['peak_mb']:>9.2f}{r['max_rss_mb']:>9.1f}"
+                      f"{r['warm_seconds']:>9.3f}{r['warm_server']['not_modified']:>6}"
+                      f"{r['warm_server']['bytes'] / 1024:>10.0f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Resultados en {args.out}")
+
+if __name__ == "__main__":
+    main()
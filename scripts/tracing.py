@@ -0,0 +1,181 @@
+# scripts/tracing.py
+
+"""
+Trazas de tiempos por etapa de una ejecución.
+
+Se activan con FEEDBUENO_TRACE=<fichero.json>; FEEDBUENO_TRACE_FORMAT=chrome
+lo escribe en formato trace-event (chrome://tracing, Perfetto) en lugar del
+árbol JSON propio. Sin FEEDBUENO_TRACE todo es no-op: span() devuelve siempre
+el mismo objeto vacío y add()/stage() vuelven nada más entrar.
+
+- span(nombre, **attrs): tramo anidado (carpeta, URL, descarga) con tiempo
+  de pared y de CPU del hilo, contadores y tramos hijos.
+- stage(nombre): etapa por ítem (descripción, om:sec, escritura...). No crea
+  un tramo por ítem; acumula veces, pared y CPU en el tramo actual.
+- add(contador, n): suma al tramo actual (bytes, ítems leídos/nuevos,
+  pasadas de regex...).
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+TRACE_FILE = os.environ.get("FEEDBUENO_TRACE", "")
+TRACE_FORMAT = os.environ.get("FEEDBUENO_TRACE_FORMAT", "json").strip().lower()
+ENABLED = bool(TRACE_FILE)
+
+_local = threading.local()
+_roots = []
+_roots_lock = threading.Lock()
+_t0 = time.perf_counter()
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+NO_SPAN = _NoSpan()
+
+class Span:
+    __slots__ = ("name", "attrs", "counters", "stages", "children", "tid",
+                 "start", "wall", "cpu", "_cpu0")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name, self.attrs = name, attrs
+        self.counters, self.stages, self.children = {}, {}, []
+        self.tid = threading.get_ident()
+        self.start = self.wall = self.cpu = self._cpu0 = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            stack[-1].children.append(self)
+        else:
+            with _roots_lock:
+                _roots.append(self)
+        stack.append(self)
+        self._cpu0 = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.start
+        self.cpu = time.thread_time() - self._cpu0
+        _stack().pop()
+        if exc[0] is not None:
+            self.attrs["error"] = repr(exc[1])
+        return False
+
+    def to_dict(self) -> dict:
+        d = {
+            "name": self.name,
+            "start_s": round(self.start - _t0, 6),
+            "wall_s": round(self.wall, 6),
+            "cpu_s": round(self.cpu, 6),
+        }
+        if self.attrs: d["attrs"] = self.attrs
+        if self.counters: d["counters"] = self.counters
+        if self.stages:
+            d["stages"] = {k: {"count": c, "wall_s": round(w, 6), "cpu_s": round(u, 6)}
+                           for k, (c, w, u) in self.stages.items()}
+        if self.children: d["children"] = [c.to_dict() for c in self.children]
+        return d
+
+def _stack() -> list:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def span(name: str, **attrs):
+    return Span(name, attrs) if ENABLED else NO_SPAN
+
+def add(counter: str, n: int = 1):
+    if not ENABLED:
+        return
+    stack = _stack()
+    if stack:
+        counters = stack[-1].counters
+        counters[counter] = counters.get(counter, 0) + n
+
+class _Stage:
+    __slots__ = ("name", "_wall0", "_cpu0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._cpu0 = time.thread_time()
+        self._wall0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall0
+        cpu = time.thread_time() - self._cpu0
+        stack = _stack()
+        if stack:
+            stages = stack[-1].stages
+            c, w, u = stages.get(self.name, (0, 0.0, 0.0))
+            stages[self.name] = (c + 1, w + wall, u + cpu)
+        return False
+
+def stage(name: str):
+    return _Stage(name) if ENABLED else NO_SPAN
+
+# -------------- salida --------------
+
+def _chrome_events(sp: Span, pid: int, out: list):
+    args = dict(sp.attrs)
+    if sp.counters: args["counters"] = sp.counters
+    if sp.stages:
+        args["stages"] = {k: {"count": c, "wall_ms": round(w * 1000, 3), "cpu_ms": round(u * 1000, 3)}
+                          for k, (c, w, u) in sp.stages.items()}
+    out.append({
+        "name": sp.name, "ph": "X", "pid": pid, "tid": sp.tid,
+        "ts": round((sp.start - _t0) * 1e6, 1), "dur": round(sp.wall * 1e6, 1),
+        "args": args,
+    })
+    for child in sp.children:
+        _chrome_events(child, pid, out)
+
+def write(path: str = None):
+    """Vuelca los tramos terminados al fichero de traza."""
+    path = path or TRACE_FILE
+    if not ENABLED or not path:
+        return
+    with _roots_lock:
+        roots = list(_roots)
+    if TRACE_FORMAT == "chrome":
+        events = []
+        for sp in roots:
+            _chrome_events(sp, os.getpid(), events)
+        data = {"traceEvents": events, "displayTimeUnit": "ms"}
+    else:
+        data = {"version": 1, "pid": os.getpid(), "spans": [sp.to_dict() for sp in roots]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    print(f"🧭 Traza guardada en {path}")
+
+@contextlib.contextmanager
+def run(name: str, **attrs):
+    """Tramo raíz de un punto de entrada; al salir escribe la traza."""
+    if not ENABLED:
+        yield NO_SPAN
+        return
+    try:
+        with span(name, **attrs) as sp:
+            yield sp
+    finally:
+        write()
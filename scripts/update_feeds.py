@@ -1,8 +1,18 @@
 # scripts/update_feeds.py
 
+import functools
 import os
 import re
-import requests
+import shutil
+import stat
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import fetcher
+import render_cache
+import tracing
+from feed_index import FeedIndex, file_digest, key_digest
+from item_xml import ItemXml
 
 # -------------- utilidades de texto --------------
 
@@ -20,8 +30,63 @@ def strip_cdata(s: str) -> str:
 def enc_cdata(s: str) -> str:
     return f"{CDATA_OPEN}{s}{CDATA_CLOSE}"
 
+# -------------- extracción de ítems --------------
+
+# "stream" recorre el documento por trozos y va entregando cada <item> en
+# cuanto se cierra; "regex" es el re.findall original, para comparar.
+ITEM_PARSER = os.environ.get("FEEDBUENO_ITEM_PARSER", "stream")
+STREAM_CHUNK = 64 * 1024
+
+ITEM_RE = re.compile(r"<item\b[^>]*>.*?</item>", flags=re.IGNORECASE | re.DOTALL)
+ITEM_START_RE = re.compile(r"<item\b[^>]*>", flags=re.IGNORECASE)
+ITEM_END_RE = re.compile(r"</item>", flags=re.IGNORECASE)
+
+def _chunks_of(xml: str):
+    for i in range(0, len(xml), STREAM_CHUNK):
+        yield xml[i:i + STREAM_CHUNK]
+
+def iter_items_stream(chunks):
+    """
+    Devuelve los mismos <item> que ITEM_RE.findall, pero a partir de trozos
+    de texto y sin guardar más que el ítem en curso. Se puede parar en
+    cualquier momento (break / close()).
+    """
+    buf, open_item, scan = "", False, 0
+    for chunk in chunks:
+        buf += chunk
+        while True:
+            if not open_item:
+                m = ITEM_START_RE.search(buf)
+                if not m:
+                    # solo puede quedar a medias una etiqueta abierta tras el último '>'
+                    lt = buf.find("<", buf.rfind(">") + 1)
+                    buf = buf[lt:] if lt >= 0 else ""
+                    break
+                buf, open_item, scan = buf[m.start():], True, m.end() - m.start()
+            m = ITEM_END_RE.search(buf, scan)
+            if not m:
+                scan = max(scan, len(buf) - len("</item>") + 1)
+                break
+            yield buf[:m.end()]
+            buf, open_item = buf[m.end():], False
+
+def iter_file_text(path: str, chunk_size: int = STREAM_CHUNK):
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def iter_items(source, backend: str = None):
+    """`source` puede ser el documento entero o un iterable de trozos."""
+    if (backend or ITEM_PARSER) == "regex":
+        xml = source if isinstance(source, str) else "".join(source)
+        return (m.group(0) for m in ITEM_RE.finditer(xml))
+    return iter_items_stream(_chunks_of(source) if isinstance(source, str) else source)
+
 def findall_items(xml: str):
-    return re.findall(r"<item\b[^>]*>.*?</item>", xml, flags=re.IGNORECASE | re.DOTALL)
+    return list(iter_items(xml))
 
 def find_tag_text(xml: str, tag: str):
     m = re.search(rf"<{tag}\b[^>]*>(.*?)</{tag}>", xml, flags=re.IGNORECASE | re.DOTALL)
@@ -31,6 +96,73 @@ def find_attr(xml: str, tag: str, attr: str):
     m = re.search(rf"<{tag}\b[^>]*\b{attr}=\"([^\"]+)\"[^>]*/?>", xml, flags=re.IGNORECASE | re.DOTALL)
     return m.group(1) if m else ""
 
+# -------------- ficha de episodio --------------
+
+# Etiquetas de un <item> que usa el pipeline, con el campo de Episode que rellenan
+EPISODE_TAGS = {
+    "guid": "guid", "link": "link", "title": "title", "pubdate": "pub_date",
+    "description": "description", "itunes:season": "season", "itunes:episode": "episode",
+    "om:sec": "sec",
+}
+EPISODE_ATTRS = {"itunes:image": ("image", "href"), "media:thumbnail": ("thumbnail", "url")}
+
+EPISODE_OPEN_RE = re.compile(
+    r"<(" + "|".join(re.escape(t) for t in list(EPISODE_TAGS) + list(EPISODE_ATTRS)) + r")\b[^>]*>",
+    flags=re.IGNORECASE
+)
+EPISODE_CLOSE_RE = {t: re.compile(rf"</{re.escape(t)}>", flags=re.IGNORECASE) for t in EPISODE_TAGS}
+EPISODE_ATTR_RE = {
+    t: re.compile(rf"<{re.escape(t)}\b[^>]*\b{a}=\"([^\"]+)\"[^>]*/?>", flags=re.IGNORECASE | re.DOTALL)
+    for t, (_, a) in EPISODE_ATTRS.items()
+}
+
+class Episode:
+    """
+    Campos de un <item> extraídos en una sola pasada. Cada campo vale lo mismo
+    que find_tag_text / find_attr sobre el ítem (primera aparición, sin
+    quitar CDATA); `xml` es el ítem original.
+    """
+    __slots__ = ("xml", "guid", "link", "title", "pub_date", "description",
+                 "season", "episode", "sec", "image", "thumbnail", "_key")
+
+    def __init__(self, xml: str):
+        self.xml = xml
+        self.guid = self.link = self.title = self.pub_date = self.description = ""
+        self.season = self.episode = self.sec = self.image = self.thumbnail = ""
+        self._key = None
+
+    @property
+    def image_url(self) -> str:
+        return self.image or self.thumbnail
+
+    @property
+    def key(self) -> str:
+        if self._key is None:
+            self._key = episode_key(self)
+        return self._key
+
+def parse_episode(item_xml: str) -> Episode:
+    ep = Episode(item_xml)
+    pending = set(EPISODE_TAGS) | set(EPISODE_ATTRS)
+    for m in EPISODE_OPEN_RE.finditer(item_xml):
+        tag = m.group(1).lower()
+        if tag not in pending:
+            continue
+        if tag in EPISODE_ATTRS:
+            a = EPISODE_ATTR_RE[tag].match(m.group(0))
+            if not a:
+                continue
+            setattr(ep, EPISODE_ATTRS[tag][0], a.group(1))
+        else:
+            close = EPISODE_CLOSE_RE[tag].search(item_xml, m.end())
+            if close:
+                setattr(ep, EPISODE_TAGS[tag], item_xml[m.end():close.start()])
+            # sin cierre tampoco lo tendrá ninguna aparición posterior
+        pending.discard(tag)
+        if not pending:
+            break
+    return ep
+
 # -------------- utilidades para content:encoded --------------
 
 def escape_for_xml(s: str) -> str:
@@ -44,10 +176,11 @@ def escape_for_xml(s: str) -> str:
 
 # -------------- modificación de replace_description --------------
 
-def replace_description(item_xml: str, new_desc_html_cdata: str, sec_id: str, atom_link: str) -> str:
+def replace_description(item_xml, new_desc_html_cdata: str, sec_id: str, atom_link: str):
     """
     Reemplaza <description> con CDATA y <content:encoded> con HTML escapado (sin CDATA).
     También añade <om:sec> y el aviso 'Si no ves las imágenes...'.
+    Acepta el ítem como texto (y devuelve texto) o como ItemXml (y lo edita).
     """
     link = f"{atom_link}#{sec_id}" if atom_link else f"#{sec_id}"
     inner_html = strip_cdata(new_desc_html_cdata)
@@ -58,51 +191,31 @@ def replace_description(item_xml: str, new_desc_html_cdata: str, sec_id: str, at
         '<hr style="border:0;border-top:1px dashed #ccc;margin:20px 0;" />'
     )
 
+    item = item_xml if isinstance(item_xml, ItemXml) else ItemXml(item_xml)
+
     # description con CDATA
-    desc_cdata = enc_cdata(inner_html_with_aviso)
-    if re.search(r"<description\b", item_xml, flags=re.IGNORECASE):
-        item_xml = re.sub(
-            r"<description\b[^>]*>.*?</description>",
-            f"<description>{desc_cdata}</description>",
-            item_xml,
-            flags=re.IGNORECASE | re.DOTALL
-        )
-    else:
-        item_xml = re.sub(
-            r"</item>\s*$",
-            f"<description>{desc_cdata}</description>\n</item>",
-            item_xml,
-            flags=re.IGNORECASE | re.DOTALL
-        )
+    item.set_or_append("description", f"<description>{enc_cdata(inner_html_with_aviso)}</description>")
 
     # content:encoded con HTML escapado (sin CDATA)
     content_text = escape_for_xml(inner_html_with_aviso)
-    content_tag = f'<content:encoded xmlns:content="http://purl.org/rss/1.0/modules/content/">{content_text}</content:encoded>'
-    if re.search(r"<content:encoded\b", item_xml, flags=re.IGNORECASE):
-        item_xml = re.sub(
-            r"<content:encoded\b[^>]*>.*?</content:encoded>",
-            content_tag,
-            item_xml,
-            flags=re.IGNORECASE | re.DOTALL
-        )
-    else:
-        item_xml = re.sub(
-            r"</item>\s*$",
-            f"{content_tag}\n</item>",
-            item_xml,
-            flags=re.IGNORECASE | re.DOTALL
-        )
+    item.set_or_append(
+        "content:encoded",
+        f'<content:encoded xmlns:content="http://purl.org/rss/1.0/modules/content/">{content_text}</content:encoded>'
+    )
 
     # añadir om:sec si no existe
-    if not re.search(r"<om:sec>", item_xml, flags=re.IGNORECASE):
-        item_xml = re.sub(
-            r"</item>\s*$",
-            f"<om:sec>{sec_id}</om:sec>\n</item>",
-            item_xml,
-            flags=re.IGNORECASE | re.DOTALL
-        )
+    if not item.has("om:sec"):
+        item.append(f"<om:sec>{sec_id}</om:sec>")
+
+    return item if item is item_xml else str(item)
 
-    return item_xml
+def apply_op3(item: ItemXml, op3_prefix: str) -> bool:
+    """Antepone el prefijo OP3 a la URL de los <enclosure> (tomando la del primero)."""
+    url = item.attr("enclosure", "url")
+    if not url:
+        return False
+    item.set_attr("enclosure", "url", op3_prefix.strip() + url)
+    return True
 
 # -------------- helpers HTML mixto --------------
 
@@ -127,27 +240,137 @@ def unprotect_blocks(text: str, tokens):
         return tokens[idx] if 0 <= idx < len(tokens) else m.group(0)
     return TOKEN_RE.sub(replace_token, text)
 
+# -------------- normalizador HTML de una pasada --------------
+
+# mismo orden de prioridad que protect_blocks
+PROTECTED_TAGS = ("ol", "ul", "a", "pre", "code")
+PROTECTED_PRIORITY = {tag: i for i, tag in enumerate(PROTECTED_TAGS)}
+HTML_EVENT_RE = re.compile(r"</(?:ol|ul|a|pre|code)>|<(?:ol|ul|a|pre|code|p)\b", flags=re.IGNORECASE)
+LINE_BREAK_RE = re.compile(r"</p\s*>|<br\s*/?>", flags=re.IGNORECASE)
+BR_RE = re.compile(r"<br\s*/?>", flags=re.IGNORECASE)
+# por encima de este tamaño no se recurre nunca a la cadena de regex: con
+# etiquetas sin cerrar es cuadrática (unos 6 ms en el peor caso con 4 KiB,
+# más de 1 s con 60 KiB); por encima se usa el troceo no estricto
+LEGACY_MAX = 4 * 1024
+
+# marcas internas; los caracteres de control no pueden aparecer en XML 1.0
+BLOCK_MARK, P_MARK = "\x00", "\x01"
+
+class Protected(str):
+    """Línea que es un bloque protegido (ol/ul/a/pre/code) y se copia tal cual."""
+    __slots__ = ()
+
+def split_description(body: str, strict: bool = True):
+    """
+    Equivale a protect_blocks + quitar <p>/</p>/<br> + splitlines, pero en
+    una sola pasada lineal sobre las etiquetas: los bloques protegidos salen
+    como líneas Protected (en vez de [[BLOCKn]]) y el resto ya partido en
+    líneas. Los cierres y '>' se buscan con punteros que solo avanzan, así
+    que etiquetas sin cerrar no disparan el backtracking de '.*?'.
+
+    Con strict=True devuelve None en los casos raros en que la cadena de
+    regex daría otra cosa (bloques protegidos anidados con otra prioridad,
+    etiquetas dentro de un <p ...>, <br> que aparecen al quitar un <p>).
+    """
+    if BLOCK_MARK in body or P_MARK in body:
+        if strict: return None
+        body = body.replace(BLOCK_MARK, "").replace(P_MARK, "")
+    if strict and "[[BLOCK" in body:
+        return None
+    events = [(m.start(), m.group(0).lower()) for m in HTML_EVENT_RE.finditer(body)]
+    size = len(body)
+    closes, close_ptr = {}, {}
+    for start, ev in events:
+        if ev[1] == "/":
+            closes.setdefault(ev[2:-1], []).append(start)
+
+    parts, blocks = [], []
+    pos, gt, lt = 0, -1, -1     # inicio del texto pendiente, próximo '>' y '<'
+    i, n = 0, len(events)
+    while i < n:
+        start, ev = events[i]
+        i += 1
+        if start < pos or ev[1] == "/":
+            continue
+        end = start + len(ev)
+        if gt < end:
+            gt = body.find(">", end)
+            if gt == -1: gt = size
+        if gt == size:
+            continue
+        tag = ev[1:]
+        if tag == "p":
+            if lt < end:
+                lt = body.find("<", end)
+                if lt == -1: lt = size
+            if lt < gt:
+                if strict: return None
+                continue
+            # la marca evita que </p> o <br> se formen al pegar los trozos
+            parts += (body[pos:start], P_MARK)
+            pos = gt + 1
+            continue
+        tag_closes, k = closes.get(tag, ()), close_ptr.get(tag, 0)
+        while k < len(tag_closes) and tag_closes[k] <= gt:
+            k += 1
+        close_ptr[tag] = k
+        if k == len(tag_closes):
+            continue
+        block_end = tag_closes[k] + len(tag) + 3
+        rank = PROTECTED_PRIORITY[tag]
+        while i < n and events[i][0] < block_end:
+            inner = events[i][1]
+            if strict and inner[1] != "/" and PROTECTED_PRIORITY.get(inner[1:], rank) < rank:
+                return None
+            i += 1
+        parts += (body[pos:start], "\n", BLOCK_MARK, "\n")
+        blocks.append(Protected(body[start:block_end]))
+        pos = block_end
+    parts.append(body[pos:])
+
+    text = LINE_BREAK_RE.sub("\n", "".join(parts)).replace(P_MARK, "")
+    # un <br> o un [[BLOCKn]] que aparece al quitar un <p ...> sí lo habría
+    # cambiado la cadena de regex
+    if strict and ("[[BLOCK" in text or BR_RE.search(text)):
+        return None
+    lines = text.splitlines()
+    if blocks:
+        it = iter(blocks)
+        lines = [next(it) if ln == BLOCK_MARK else ln for ln in lines]
+    return lines
+
 # -------------- enriquecidos inline --------------
 
 IMG_URL_RE = re.compile(
     r'(?<!href=")(https?://[^\s<>"\']+\.(?:jpg|jpeg|png|gif|webp)(?:\?[^\s<>"\']*)?)',
     flags=re.IGNORECASE
 )
-LINK_URL_RE = re.compile(
-    r'(?<!href=")(https?://[^\s<>"\']+)',
+
+# emails, URLs de imagen y URLs normales en una sola pasada; las URLs que ya
+# son el valor de un atributo (href="...", src="...") se dejan como están
+LINKIFY_RE = re.compile(
+    r'(?<!=["\'])(?P<url>https?://[^\s<>"\']+)'
+    r'|(?<![>\w@])(?P<email>[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,})',
     flags=re.IGNORECASE
 )
-EMAIL_RE = re.compile(
-    r'(?<![>\w@])([A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,})'
-)
+# las mismas líneas de patrocinio y redes se repiten en casi todos los episodios
+LINKIFY_CACHE_SIZE = 4096
+
+def _linkify_match(m) -> str:
+    email = m.group("email")
+    if email:
+        return f'<a href="mailto:{email}">{email}</a>'
+    url = m.group("url")
+    img = IMG_URL_RE.match(url)
+    if not img:
+        return f'<a href="{url}">{url}</a>'
+    src, rest = img.group(1), url[img.end():]
+    return f'<a href="{src}"><img src="{src}" /></a>' + (LINKIFY_RE.sub(_linkify_match, rest) if rest else "")
 
+@functools.lru_cache(maxsize=LINKIFY_CACHE_SIZE)
 def transform_inline(text: str) -> str:
-    text = EMAIL_RE.sub(r'<a href="mailto:\1">\1</a>', text)
-    def repl_image(m): return f'<a href="{m.group(1)}"><img src="{m.group(1)}" /></a>'
-    text = IMG_URL_RE.sub(repl_image, text)
-    def repl_link(m): return f'<a href="{m.group(1)}">{m.group(1)}</a>'
-    text = LINK_URL_RE.sub(repl_link, text)
-    return text
+    """Enlaza emails, imágenes y URLs de `text` sin volver a envolver lo ya enlazado."""
+    return LINKIFY_RE.sub(_linkify_match, text)
 
 # -------------- listas --------------
 
@@ -158,7 +381,7 @@ def detect_lists_from_lines(lines):
     out, i = [], 0
     while i < len(lines):
         stripped = (lines[i] or "").strip()
-        if TOKEN_RE.fullmatch(stripped):
+        if isinstance(lines[i], Protected) or TOKEN_RE.fullmatch(stripped):
             out.append(stripped); i += 1; continue
         m = NUM_LIST_LINE.match(stripped)
         if m:
@@ -203,6 +426,13 @@ def process_description_block(title_txt: str, link_txt: str, image_url: str,
     header += '<hr style="border:0;border-top:1px dashed #ccc;margin:20px 0;" />\n'
 
     body = strip_cdata(description_inner or "")
+    lines = split_description(body)
+    if lines is None and len(body) > LEGACY_MAX:
+        lines = split_description(body, strict=False)
+    if lines is not None:
+        return header + detect_lists_from_lines(lines)
+
+    # HTML raro (bloques anidados...) y corto: la cadena de regex de siempre
     protected, tokens = protect_blocks(body)
     protected = re.sub(r"</p\s*>", "\n", protected, flags=re.IGNORECASE)
     protected = re.sub(r"<p\b[^>]*>", "", protected, flags=re.IGNORECASE)
@@ -214,136 +444,591 @@ def process_description_block(title_txt: str, link_txt: str, image_url: str,
 
     return header + rebuilt
 
+# -------------- render con caché --------------
+
+# súbela al cambiar el HTML que generan process_description_block /
+# replace_description: invalida todo lo guardado en la caché de renders
+TRANSFORM_VERSION = "4"   # 4: la cadena de regex solo para descripciones raras de hasta 4 KiB
+
+def render_item(ep: Episode, feed_img: str, atom_link: str, sec_id: str, op3_prefix: str = "") -> str:
+    """
+    process_description_block + replace_description (+ prefijo OP3) de un
+    episodio, troceando el ítem una sola vez. La clave de la caché cubre todo
+    lo que influye en el resultado: el ítem de origen (título, enlace, imagen,
+    descripción...), la imagen del feed, atom:link, el om:sec, el prefijo OP3
+    y TRANSFORM_VERSION.
+    """
+    cache = render_cache.shared(fetcher.CACHE_DIR)
+    if cache is not None:
+        key = render_cache.render_key(TRANSFORM_VERSION, ep.xml, feed_img, atom_link, sec_id, op3_prefix)
+        item = cache.get(key)
+        if item is not None:
+            tracing.add("render_hits")
+            return item
+    item = render_uncached(ep, feed_img, atom_link, sec_id, op3_prefix)
+    if cache is not None:
+        cache.put(key, item)
+    return item
+
+def render_uncached(ep: Episode, feed_img: str, atom_link: str, sec_id: str, op3_prefix: str = "") -> str:
+    new_desc = process_description_block(
+        strip_cdata(ep.title),
+        strip_cdata(ep.link),
+        ep.image_url,
+        ep.description,
+        feed_img
+    )
+    xml = replace_description(ItemXml(ep.xml), new_desc, sec_id, atom_link)
+    if op3_prefix:
+        apply_op3(xml, op3_prefix)
+    return str(xml)
+
 # -------------- claves / fetch --------------
 
 def normalize_inner(t: str) -> str:
     t = strip_cdata(t or "")
     return re.sub(r"\s+", " ", t).strip().lower()
 
-def item_key_from_xml(item_xml: str) -> str:
-    guid = normalize_inner(find_tag_text(item_xml, "guid"))
+def episode_key(ep: Episode) -> str:
+    guid = normalize_inner(ep.guid)
     if guid: return "guid:" + guid
-    link = normalize_inner(find_tag_text(item_xml, "link"))
+    link = normalize_inner(ep.link)
     if link: return "link:" + link
-    title = normalize_inner(find_tag_text(item_xml, "title"))
-    pub = normalize_inner(find_tag_text(item_xml, "pubDate"))
+    title = normalize_inner(ep.title)
+    pub = normalize_inner(ep.pub_date)
     return "tp:" + title + "|" + pub
 
+def item_key_from_xml(item_xml: str) -> str:
+    return parse_episode(item_xml).key
+
 def existing_keys_from_feed(xml: str) -> set:
-    return {item_key_from_xml(it) for it in findall_items(xml)}
+    return {item_key_from_xml(it) for it in iter_items(xml)}
+
+def load_feed_index(dest_file: str) -> FeedIndex:
+    """
+    Índice de claves del feed; se reconstruye, leyendo el feed ítem a ítem,
+    solo si no cuadra con el fichero. Su `sha1` es la firma del feed
+    (file_digest), que solo se calcula si el tamaño o la fecha han cambiado.
+    """
+    old = FeedIndex.load(dest_file)
+    if old is not None and old.matches(dest_file):
+        return old
+    feed_sig = file_digest(dest_file)
+    if old is not None and old.matches(dest_file, feed_sig):
+        return old
+    # el mapa clave -> om:sec se conserva aunque el índice esté desfasado
+    idx = FeedIndex(sec_by_key=old.sec_by_key if old is not None else None)
+    for ep in map(parse_episode, iter_items(iter_file_text(dest_file))):
+        digest = key_digest(ep.key)
+        idx.keys.add(digest)
+        idx.secs.extend(re.findall(r"<om:sec>(.*?)</om:sec>", ep.xml, flags=re.IGNORECASE))
+        tracing.add("regex_passes")
+        if ep.sec:
+            idx.sec_by_key[digest] = ep.sec
+    idx.stamp(dest_file, feed_sig)
+    idx.rebuilt = True
+    return idx
+
+class LazyItems:
+    """
+    Secuencia de ítems que se parsea a medida que alguien la recorre, de modo
+    que varios consumidores comparten el trabajo y nadie parsea de más.
+    """
+    __slots__ = ("_items", "_source")
+
+    def __init__(self, source):
+        self._items = []
+        self._source = iter(source)
+
+    def _pull(self) -> bool:
+        if self._source is None:
+            return False
+        try:
+            self._items.append(next(self._source))
+            return True
+        except StopIteration:
+            self._source = None
+            return False
+
+    def __iter__(self):
+        i = 0
+        while i < len(self._items) or self._pull():
+            yield self._items[i]
+            i += 1
+
+    def __len__(self):
+        while self._pull():
+            pass
+        return len(self._items)
+
+# (url, versión) -> LazyItems, y cuántas carpetas van a leer aún cada url
+_parsed_items = {}
+_readers = {}
+
+def parse_source_items(src):
+    """
+    Episodios de una fuente descargada, leyendo el cuerpo del fichero de la
+    caché por trozos. Si otra carpeta va a leer la misma fuente (ver
+    expect_readers) se comparten en un LazyItems hasta release_source, así
+    que se parsean una vez por versión y ejecución; si no, no se guarda más
+    que el ítem en curso.
+    """
+    key = (src.url, src.version)
+    items = _parsed_items.get(key)
+    if items is None:
+        items = map(parse_episode, iter_items(src.iter_text()))
+        if _readers.get(src.url, 0) > 1:
+            items = _parsed_items[key] = LazyItems(items)
+    return items
+
+def expect_readers(urls):
+    """Anota que otra carpeta va a leer cada una de `urls` en esta ejecución."""
+    for url in urls:
+        _readers[url] = _readers.get(url, 0) + 1
+
+def release_source(url: str):
+    """
+    Una carpeta ha terminado con `url`. Cuando no queda ninguna por leerla se
+    olvidan sus ítems parseados (cabeza y fuente entera).
+    """
+    left = _readers.pop(url, 0) - 1
+    if left > 0:
+        _readers[url] = left
+        return
+    for key in [k for k in _parsed_items if k[0] == url]:
+        del _parsed_items[key]
+
+def reset_run():
+    _parsed_items.clear()
+    _readers.clear()
+    render_cache.reset()
+    fetcher.reset_run()
+
+class SourceItems:
+    """
+    Episodios de una fuente. Si de ella solo se ha bajado la cabeza
+    (FEEDBUENO_HEAD_KB) y el consumidor la recorre entera sin llegar a su
+    parada temprana, se baja la fuente entera y se sigue por donde iba, sin
+    repetir ítems. `src` es la descarga que se ha usado al final (su versión
+    es la que hay que recordar).
+    """
+    __slots__ = ("src",)
+
+    def __init__(self, src):
+        self.src = src
+
+    def __iter__(self):
+        head, seen = self.src, set()
+        for ep in parse_source_items(head):
+            if head.partial:
+                seen.add(ep.key)
+            yield ep
+        if not head.partial:
+            return
+        tracing.add("head_fallback")
+        self.src = fetcher.fetch_full(head.url)
+        for ep in parse_source_items(self.src):
+            if ep.key not in seen:
+                yield ep
 
 def fetch_source_items(url: str) -> list:
-    r = requests.get(url, timeout=20, headers={"User-Agent": "FeedbuenoUpdater/1.0"})
-    r.raise_for_status()
-    return findall_items(r.text)
+    return list(iter_items(fetcher.fetch_full(url).iter_text()))
+
+def read_source_urls(source_file: str) -> list:
+    """
+    Fuentes de un fichero, una por línea. Una línea puede llevar espejos de
+    la misma fuente separados por "|" (ver fetcher); se devuelve tal cual.
+    """
+    if not os.path.exists(source_file):
+        return []
+    with open(source_file, "r", encoding="utf-8") as f:
+        return [ln.strip() for ln in f if ln.strip()]
+
+def feed_dirs(base: str, only=None) -> list:
+    """Carpetas de `base`; con `only`, solo las que tienen esos nombres."""
+    paths = []
+    for name in os.listdir(base):
+        path = os.path.join(base, name)
+        if os.path.isdir(path) and (not only or name in only):
+            paths.append(path)
+    return paths
+
+def prefetch_dirs(base: str, source_filename: str = "source.txt", only=None) -> int:
+    """Precarga en paralelo las fuentes de todas las carpetas de `base` (o de `only`)."""
+    urls = []
+    for path in feed_dirs(base, only):
+        if source_filename == "source.txt" and has_image_feed(path):
+            continue
+        if os.path.exists(os.path.join(path, "feed.xml")):
+            dir_urls = read_source_urls(os.path.join(path, source_filename))
+            expect_readers(dir_urls)
+            urls.extend(dir_urls)
+    return fetcher.prefetch(urls)
+
+def has_image_feed(feed_dir: str) -> bool:
+    """
+    Las carpetas con imagen.txt son de update_feeds_with_image, que copia ese
+    fichero a source.txt; update_feeds las salta para que ningún ítem nuevo
+    entre sin pasar por su hook.
+    """
+    return os.path.exists(os.path.join(feed_dir, "imagen.txt"))
+
+# -------------- parada temprana --------------
+
+# Las fuentes van de más nuevo a más antiguo: al llegar a la marca de la
+# ejecución anterior, o tras EARLY_STOP ítems seguidos ya conocidos, el resto
+# del histórico no puede traer nada nuevo. 0 desactiva la parada.
+EARLY_STOP = int(os.environ.get("FEEDBUENO_EARLY_STOP", "10"))
+# marca de una fuente que se quedó a medias (falló la descarga entera tras la
+# cabeza, o un ítem): sus primeros ítems ya están en el feed, así que la
+# próxima vez se lee entera, sin marca ni parada temprana
+FULL_READ = "*full*"
+
+class KnownRun:
+    """Cuenta ítems ya conocidos seguidos de una fuente y recuerda el primero."""
+    __slots__ = ("watermark", "early_stop", "count", "first")
+
+    def __init__(self, watermark: str = None):
+        full = watermark == FULL_READ
+        self.watermark = None if full else watermark
+        self.early_stop = 0 if full else EARLY_STOP
+        self.count = 0
+        self.first = None
+
+    def stop_after(self, key: str, known: bool) -> bool:
+        """Registra un ítem; True si ya se puede dejar de leer la fuente."""
+        if self.first is None:
+            self.first = key
+        if not known:
+            self.count = 0
+            return False
+        self.count += 1
+        return key == self.watermark or 0 < self.early_stop <= self.count
 
 # -------------- generación de om:sec --------------
 
-def extract_unique_sec_id(item_xml: str, dest_xml: str, fallback_counter: int) -> str:
+def sec_candidate(ep: Episode, fallback_counter: int) -> str:
     # 1. Si hay season y episode
-    season = strip_cdata(find_tag_text(item_xml, "itunes:season"))
-    episode = strip_cdata(find_tag_text(item_xml, "itunes:episode"))
+    season = strip_cdata(ep.season)
+    episode = strip_cdata(ep.episode)
     if season and episode:
         candidate = f"s{season}e{episode}"
     else:
         # 2. Buscar número en título o descripción
-        title = strip_cdata(find_tag_text(item_xml, "title"))
-        desc = strip_cdata(find_tag_text(item_xml, "description"))
+        title = strip_cdata(ep.title)
+        desc = strip_cdata(ep.description)
         m = re.search(r"\d+", title or "") or re.search(r"\d+", desc or "")
         candidate = m.group(0) if m else None
 
     # 3. Si no hay nada, inventar número
-    if not candidate:
-        candidate = str(fallback_counter)
+    return candidate or str(fallback_counter)
 
-    # Evitar colisiones con otros <om:sec>
-    existing_secs = set(re.findall(r"<om:sec>(.*?)</om:sec>", dest_xml, flags=re.IGNORECASE))
-    while candidate in existing_secs:
-        candidate = str(int(candidate) + 1) if candidate.isdigit() else candidate + "_x"
+def extract_unique_sec_id(item, dest_xml: str, fallback_counter: int) -> str:
+    """
+    Versión suelta para un único ítem; update_feed_dir usa el reparto del
+    índice del feed, que además no repite ids dentro de la misma tanda.
+    """
+    ep = item if isinstance(item, Episode) else parse_episode(item)
+    idx = FeedIndex(secs=re.findall(r"<om:sec>(.*?)</om:sec>", dest_xml, flags=re.IGNORECASE))
+    return idx.allocate_sec(None, sec_candidate(ep, fallback_counter))
+
+# -------------- escritura del feed --------------
 
-    return candidate
+FIRST_ITEM_RE = re.compile(r"<item\b", flags=re.IGNORECASE)
+HEAD_CHUNK = 8 * 1024
+
+def read_feed_head(dest_file: str):
+    """
+    Lee el feed solo hasta su primer <item> (cabecera del canal). Devuelve
+    (cabecera, hay_items); si no hay ítems la cabecera es el feed entero.
+    """
+    buf = ""
+    with open(dest_file, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.read(HEAD_CHUNK)
+            pos = max(0, len(buf) - len("<item"))
+            buf += chunk
+            m = FIRST_ITEM_RE.search(buf, pos)
+            # "<item" al final del trozo: hace falta el carácter siguiente para \b
+            if m and (m.end() < len(buf) or not chunk):
+                return buf[:m.start()], True
+            if not chunk:
+                return buf, False
+
+def write_new_items(dest_file: str, head: str, has_items: bool, new_items: list) -> str:
+    """
+    Inserta `new_items` delante del primer <item> (o antes de </channel>).
+    Escribe cabecera + ítems nuevos + resto del feed copiado por trozos en un
+    temporal y lo cambia por el original con os.replace, así que nadie ve
+    nunca un feed a medias. Devuelve la firma (file_digest) del feed nuevo.
+    """
+    insertion_block = "\n".join(new_items)
+    fd, tmp = tempfile.mkstemp(prefix=".feed-", suffix=".tmp", dir=os.path.dirname(dest_file))
+    try:
+        with open(fd, "w", encoding="utf-8") as out:
+            if has_items:
+                out.write(head)
+                out.write(insertion_block + "\n")
+                with open(dest_file, "r", encoding="utf-8") as src:
+                    src.read(len(head))
+                    shutil.copyfileobj(src, out, STREAM_CHUNK)
+            else:
+                out.write(re.sub(r"</channel>\s*$", insertion_block + "\n</channel>", head,
+                                 flags=re.IGNORECASE | re.DOTALL))
+            out.flush()
+            os.fsync(out.fileno())
+        os.chmod(tmp, stat.S_IMODE(os.stat(dest_file).st_mode))
+        os.replace(tmp, dest_file)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return file_digest(dest_file)
 
 # -------------- actualización --------------
 
-def update_feed_dir(feed_dir: str):
+def update_feed_dir(feed_dir: str, item_hook=None):
+    """
+    item_hook(item: ItemXml, feed_img: str) -> bool, si se pasa, retoca cada
+    ítem nuevo antes de escribirlo (True si lo ha cambiado). Los ítems que ya
+    estaban en el feed no se vuelven a leer.
+    """
+    with tracing.span("feed_dir", dir=feed_dir):
+        _update_feed_dir(feed_dir, item_hook)
+
+def _update_feed_dir(feed_dir: str, item_hook=None):
     source_file = os.path.join(feed_dir, "source.txt")
     dest_file   = os.path.join(feed_dir, "feed.xml")
 
     if not (os.path.exists(source_file) and os.path.exists(dest_file)):
         print(f"⏭️  Omitido {feed_dir}: falta source.txt o feed.xml"); return
 
-    with open(source_file, "r", encoding="utf-8") as f:
-        source_urls = [ln.strip() for ln in f if ln.strip()]
+    source_urls = read_source_urls(source_file)
     if not source_urls: print(f"ℹ️  {feed_dir}: source.txt vacío"); return
 
-    with open(dest_file, "r", encoding="utf-8") as f:
-        dest_xml = f.read()
+    with tracing.stage("head"):
+        head, has_items = read_feed_head(dest_file)
 
-    atom_link = find_attr(dest_xml, "atom:link", "href") or ""
-    feed_img  = find_attr(dest_xml, "itunes:image", "href") or ""
-    op3_prefix = find_tag_text(dest_xml, "op3")
+    atom_link = find_attr(head, "atom:link", "href") or ""
+    feed_img  = find_attr(head, "itunes:image", "href") or ""
+    op3_prefix = find_tag_text(head, "op3")
 
-    existing = existing_keys_from_feed(dest_xml)
+    with tracing.stage("index"):
+        existing = load_feed_index(dest_file)
+        feed_sig = existing.sha1
     new_items, sec_counter = [], 1
+    versions, marks = {}, {}
 
     for url in source_urls:
-        try:
-            for raw_item in fetch_source_items(url):
-                key = item_key_from_xml(raw_item)
-                if key in existing: continue
-                title_inner = find_tag_text(raw_item, "title")
-                link_inner  = find_tag_text(raw_item, "link")
-                img = find_attr(raw_item, "itunes:image", "href") or find_attr(raw_item, "media:thumbnail", "url") or ""
-                desc_inner  = find_tag_text(raw_item, "description")
-                new_desc = process_description_block(
-                    strip_cdata(title_inner),
-                    strip_cdata(link_inner),
-                    img,
-                    desc_inner,
-                    feed_img
-                )
-
-                sec_id = extract_unique_sec_id(raw_item, dest_xml, sec_counter)
-                new_item = replace_description(raw_item, new_desc, sec_id, atom_link)
-
-                # Prefix OP3
-                if op3_prefix:
-                    m = re.search(r'<enclosure\b([^>]*)url="([^"]+)"([^>]*)/>', new_item, flags=re.IGNORECASE)
-                    if m:
-                        new_url = op3_prefix.strip() + m.group(2)
-                        new_item = re.sub(
-                            r'(<enclosure\b[^>]*url=")[^"]+(")',
-                            rf'\1{new_url}\2',
-                            new_item, flags=re.IGNORECASE
-                        )
-
-                new_items.append(new_item)
-                existing.add(key)
-                sec_counter += 1
-        except Exception as e:
-            print(f"⚠️  Error leyendo {url}: {e}")
-
-    if not new_items: print(f"= {feed_dir}: sin nuevos episodios"); return
+        with tracing.span("source", url=url):
+            items = None
+            try:
+                with tracing.stage("fetch_wait"):
+                    src = fetcher.fetch(url)
+                watermark = fetcher.watermark(dest_file, url)
+                if fetcher.source_unchanged(dest_file, feed_sig, src):
+                    tracing.add("unchanged")
+                    versions[url], marks[url] = src.version, watermark; continue
+                run = KnownRun(watermark)
+                items = SourceItems(src)
+                for ep in items:
+                    tracing.add("items_scanned")
+                    key = ep.key
+                    if key in existing:
+                        if run.stop_after(key, True): break
+                        continue
+                    run.stop_after(key, False)
+                    with tracing.stage("sec"):
+                        sec_id = existing.allocate_sec(key, sec_candidate(ep, sec_counter))
+                    with tracing.stage("render"):
+                        new_item = render_item(ep, feed_img, atom_link, sec_id, op3_prefix)
+                    if item_hook:
+                        with tracing.stage("hook"):
+                            item = ItemXml(new_item)
+                            if item_hook(item, feed_img):
+                                new_item = str(item)
 
-    insertion_block = "\n".join(new_items)
-    first_item = re.search(r"<item\b", dest_xml, flags=re.IGNORECASE)
-    updated_xml = (
-        dest_xml[:first_item.start()] + insertion_block + "\n" + dest_xml[first_item.start():]
-        if first_item else
-        re.sub(r"</channel>\s*$", insertion_block + "\n</channel>", dest_xml, flags=re.IGNORECASE | re.DOTALL)
-    )
+                    new_items.append(new_item)
+                    existing.add(key, find_tag_text(new_item, "om:sec") or sec_id)
+                    tracing.add("regex_passes")
+                    tracing.add("items_new")
+                    sec_counter += 1
+                versions[url], marks[url] = items.src.version, run.first
+            except Exception as e:
+                print(f"⚠️  Error leyendo {url}: {e}")
+                if items is not None:
+                    # puede que ya se hayan añadido ítems de la cabeza
+                    marks[url] = FULL_READ
+            finally:
+                release_source(url)
 
-    with open(dest_file, "w", encoding="utf-8") as f: f.write(updated_xml)
+    if not new_items:
+        if existing.rebuilt: existing.save(dest_file)
+        fetcher.mark_processed(dest_file, feed_sig, versions, marks)
+        print(f"= {feed_dir}: sin nuevos episodios"); return
+
+    with tracing.stage("write"):
+        feed_sig = write_new_items(dest_file, head, has_items, new_items)
+        existing.stamp(dest_file, feed_sig)
+        existing.save(dest_file)
+    fetcher.mark_processed(dest_file, feed_sig, versions, marks)
     print(f"✅ {feed_dir}: añadidos {len(new_items)} episodios nuevos")
 
+# -------------- backfill --------------
+
+# Para meter de golpe todo el histórico de una carpeta nueva: sin parada
+# temprana ni cabezas, y con el render repartido entre varios procesos.
+BACKFILL_WORKERS = int(os.environ.get("FEEDBUENO_BACKFILL_WORKERS", "0"))   # 0 = uno por CPU
+BACKFILL_CHUNK = int(os.environ.get("FEEDBUENO_BACKFILL_CHUNK", "64"))
+
+def _render_chunk(job):
+    """En un proceso del pool: renderiza un trozo de (ítem, om:sec) sin caché."""
+    feed_img, atom_link, op3_prefix, items = job
+    start = time.perf_counter()
+    out = [render_uncached(parse_episode(xml), feed_img, atom_link, sec_id, op3_prefix) for xml, sec_id in items]
+    return out, os.getpid(), time.perf_counter() - start
+
+def render_many(jobs: list, feed_img: str, atom_link: str, op3_prefix: str = "", workers: int = None):
+    """
+    render_item de cada (Episode, om:sec) de `jobs`, en el mismo orden. Lo
+    que no está en la caché de renders se reparte en trozos de BACKFILL_CHUNK
+    entre `workers` procesos. Devuelve los ítems y, por proceso, cuántos ha
+    renderizado y en cuántos segundos.
+    """
+    cache = render_cache.shared(fetcher.CACHE_DIR)
+    out, todo, keys = [None] * len(jobs), [], {}
+    for i, (ep, sec_id) in enumerate(jobs):
+        if cache is not None:
+            keys[i] = render_cache.render_key(TRANSFORM_VERSION, ep.xml, feed_img, atom_link, sec_id, op3_prefix)
+            out[i] = cache.get(keys[i])
+        if out[i] is None:
+            todo.append(i)
+        else:
+            tracing.add("render_hits")
+
+    size = max(1, BACKFILL_CHUNK)
+    chunks = [todo[n:n + size] for n in range(0, len(todo), size)]
+    work = [(feed_img, atom_link, op3_prefix, [(jobs[i][0].xml, jobs[i][1]) for i in chunk]) for chunk in chunks]
+    workers = max(1, min(workers or BACKFILL_WORKERS or os.cpu_count() or 1, len(chunks)))
+    per_worker = {}
+    if workers == 1:
+        results = map(_render_chunk, work)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_render_chunk, work)
+    try:
+        for chunk, (items, pid, seconds) in zip(chunks, results):
+            done, busy = per_worker.get(pid, (0, 0.0))
+            per_worker[pid] = (done + len(items), busy + seconds)
+            for i, item in zip(chunk, items):
+                out[i] = item
+                if cache is not None:
+                    cache.put(keys[i], item)
+    finally:
+        if workers > 1:
+            pool.shutdown()
+    return out, per_worker
+
+def backfill_feed_dir(feed_dir: str, item_hook=None, workers: int = None):
+    """
+    Como update_feed_dir, pero lee las fuentes enteras y renderiza en
+    paralelo (render_many). Los om:sec se reparten antes, en orden, y el feed
+    se escribe de una vez al final, así que el resultado es el mismo que el
+    de update_feed_dir sin parada temprana.
+    """
+    with tracing.span("backfill", dir=feed_dir):
+        _backfill_feed_dir(feed_dir, item_hook, workers)
+
+def _backfill_feed_dir(feed_dir: str, item_hook=None, workers: int = None):
+    source_file = os.path.join(feed_dir, "source.txt")
+    dest_file   = os.path.join(feed_dir, "feed.xml")
+
+    if not (os.path.exists(source_file) and os.path.exists(dest_file)):
+        print(f"⏭️  Omitido {feed_dir}: falta source.txt o feed.xml"); return
+
+    source_urls = read_source_urls(source_file)
+    if not source_urls: print(f"ℹ️  {feed_dir}: source.txt vacío"); return
+
+    head, has_items = read_feed_head(dest_file)
+    atom_link = find_attr(head, "atom:link", "href") or ""
+    feed_img  = find_attr(head, "itunes:image", "href") or ""
+    op3_prefix = find_tag_text(head, "op3")
+
+    with tracing.stage("index"):
+        existing = load_feed_index(dest_file)
+        feed_sig = existing.sha1
+    jobs, versions, marks = [], {}, {}
+    fetcher.prefetch(source_urls, full=True)
+
+    for url in source_urls:
+        with tracing.span("source", url=url):
+            try:
+                with tracing.stage("fetch_wait"):
+                    src = fetcher.fetch_full(url)
+                first = None
+                for ep in parse_source_items(src):
+                    tracing.add("items_scanned")
+                    key = ep.key
+                    first = first or key
+                    if key in existing:
+                        continue
+                    with tracing.stage("sec"):
+                        sec_id = existing.allocate_sec(key, sec_candidate(ep, len(jobs) + 1))
+                    jobs.append((ep, sec_id))
+                    # render_item no cambia un om:sec que ya traiga el ítem
+                    existing.add(key, ep.sec or sec_id)
+                versions[url], marks[url] = src.version, first
+            except Exception as e:
+                print(f"⚠️  Error leyendo {url}: {e}")
+            finally:
+                release_source(url)
+
+    if not jobs:
+        if existing.rebuilt: existing.save(dest_file)
+        fetcher.mark_processed(dest_file, feed_sig, versions, marks)
+        print(f"= {feed_dir}: sin nuevos episodios"); return
+
+    start = time.perf_counter()
+    with tracing.stage("render"):
+        new_items, per_worker = render_many(jobs, feed_img, atom_link, op3_prefix, workers)
+    if item_hook:
+        with tracing.stage("hook"):
+            for i, new_item in enumerate(new_items):
+                item = ItemXml(new_item)
+                if item_hook(item, feed_img):
+                    new_items[i] = str(item)
+    elapsed = time.perf_counter() - start
+    tracing.add("items_new", len(new_items))
+
+    with tracing.stage("write"):
+        feed_sig = write_new_items(dest_file, head, has_items, new_items)
+        existing.stamp(dest_file, feed_sig)
+        existing.save(dest_file)
+    fetcher.mark_processed(dest_file, feed_sig, versions, marks)
+
+    rendered = sum(n for n, _ in per_worker.values())
+    print(f"✅ {feed_dir}: añadidos {len(new_items)} episodios ({rendered} renderizados, "
+          f"{len(new_items) - rendered} de la caché) en {elapsed:.1f}s con {len(per_worker)} procesos")
+    for pid, (n, busy) in sorted(per_worker.items()):
+        print(f"   ⚙️  proceso {pid}: {n} ítems en {busy:.1f}s ({n / busy if busy else 0:.0f} ítems/s)")
+
+def backfill_all(base: str, only=None, workers: int = None):
+    for path in feed_dirs(base, only):
+        if not has_image_feed(path): backfill_feed_dir(path, workers=workers)
+
 # -------------- main --------------
 
+def update_all(base: str, only=None):
+    prefetch_dirs(base, only=only)
+    for path in feed_dirs(base, only):
+        if not has_image_feed(path): update_feed_dir(path)
+
 def main():
     base = os.path.join(os.getcwd(), "public")
     if not os.path.isdir(base): print("❌ No existe la carpeta 'public'"); return
-    for name in os.listdir(base):
-        path = os.path.join(base, name)
-        if os.path.isdir(path): update_feed_dir(path)
+    with tracing.run("update_feeds"):
+        update_all(base)
+        fetcher.finish_run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
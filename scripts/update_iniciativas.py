@@ -2,213 +2,276 @@
 """
 scripts/update_iniciativas.py
 
-Versión robusta que reutiliza todo desde update_feeds.py y detecta
-automáticamente las firmas de process_description_block / replace_description
-para mantener compatibilidad con cambios futuros.
+Reutiliza todo desde update_feeds.py: cada ítem se renderiza con
+render_item (con su caché de renders), igual que en update_feeds.
+
+Sin argumentos ejecuta en una pasada todas las vistas de public/*/view.txt
+(ver views.py); con --text y --source, una vista por cada carpeta que tenga
+ese archivo de fuentes, como antes.
 Imprime información detallada para debug en los logs de Actions.
 """
 import os
 import re
 import argparse
-import inspect
 import traceback
 import update_feeds as uf  # importar el módulo completo y usar sus funciones
+import tracing
+import views
 
-def ensure_itunes_tags(item_xml: str, title_text: str) -> str:
+def ensure_itunes_tags(item_xml, title_text: str) -> str:
     """
     Añade o modifica itunes:season=1 y itunes:episode=N (extraído del título).
+    Acepta el ítem como texto o como uf.ItemXml; devuelve siempre el texto.
     """
+    item = item_xml if isinstance(item_xml, uf.ItemXml) else uf.ItemXml(item_xml)
+
     # Forzar <itunes:season>1</itunes:season>
-    if re.search(r"<itunes:season>", item_xml, flags=re.IGNORECASE):
-        item_xml = re.sub(r"<itunes:season>.*?</itunes:season>",
-                          "<itunes:season>1</itunes:season>",
-                          item_xml, flags=re.IGNORECASE | re.DOTALL)
-    else:
-        item_xml = re.sub(r"</item>", "<itunes:season>1</itunes:season>\n</item>",
-                          item_xml, flags=re.IGNORECASE)
+    item.set_or_append("itunes:season", "<itunes:season>1</itunes:season>")
 
     # Extraer número del título
     m = re.search(r"(\d+)", title_text)
     episode_num = m.group(1) if m else "1"
+    item.set_or_append("itunes:episode", f"<itunes:episode>{episode_num}</itunes:episode>")
 
-    if re.search(r"<itunes:episode>", item_xml, flags=re.IGNORECASE):
-        item_xml = re.sub(r"<itunes:episode>.*?</itunes:episode>",
-                          f"<itunes:episode>{episode_num}</itunes:episode>",
-                          item_xml, flags=re.IGNORECASE | re.DOTALL)
-    else:
-        item_xml = re.sub(r"</item>", f"<itunes:episode>{episode_num}</itunes:episode>\n</item>",
-                          item_xml, flags=re.IGNORECASE)
-
-    return item_xml
+    return str(item)
 
-def try_call(func, arg_lists):
+class ViewRun:
     """
-    Intenta llamar func con cada tuple de args en arg_lists hasta que
-    uno funcione (no TypeError). Devuelve (resultado, used_args_tuple) o
-    (None, None) si todos fallan.
+    Estado de una vista durante la ejecución: cabecera e índice del feed
+    destino, ítems nuevos y, por fuente, versión descargada y marca. Las
+    fuentes con algún ítem fallido (o que no se pudieron bajar enteras tras
+    la cabeza) no se dan por procesadas: sin versión y con marca FULL_READ,
+    para que la próxima ejecución las vuelva a leer enteras.
     """
-    for args in arg_lists:
+    def __init__(self, view: views.View):
+        self.view = view
+        self.new_items = []
+        self.om_counter = 1
+        self.versions, self.marks, self.runs = {}, {}, {}
+        self.failed = set()
+
+    def open(self) -> bool:
+        view, dest_file = self.view, self.view.dest_file
+        print(f"\n--- Vista: {view.feed_dir} ---")
+        if not view.sources:
+            print("ℹ️  Sin fuentes.")
+            return False
+        if not os.path.exists(dest_file):
+            print(f"⏭️  Omitido: no existe el feed destino: {dest_file}")
+            return False
+        print(f"  - Fuentes: {len(view.sources)}")
+
+        with tracing.stage("head"):
+            self.head, self.has_items = uf.read_feed_head(dest_file)
+
+        # Datos del feed destino (para avisos y op3)
+        self.atom_link = uf.find_attr(self.head, "atom:link", "href") or ""
+        self.feed_image = uf.find_attr(self.head, "itunes:image", "href") or ""
+        self.op3_prefix = uf.find_tag_text(self.head, "op3") or ""
+        print(f"  - atom:link (destino): '{self.atom_link}'")
+        print(f"  - itunes:image (canal): '{self.feed_image}'")
+        print(f"  - op3 prefix: '{self.op3_prefix}'")
+
+        with tracing.stage("index"):
+            self.existing = uf.load_feed_index(dest_file)
+            self.feed_sig = self.existing.sha1
+        print(f"  - items ya existentes en feed destino: {len(self.existing)} keys")
+        return True
+
+    def start_source(self, src: str, fetched) -> bool:
+        """False si la fuente no ha cambiado para esta vista desde la última vez."""
+        consumer = self.view.consumer
+        self.versions[src] = fetched.version
+        self.marks[src] = uf.fetcher.watermark(consumer, src)
+        if uf.fetcher.source_unchanged(consumer, self.feed_sig, fetched):
+            print(f"   - {self.view.feed_dir}: sin cambios desde la última ejecución -> saltando")
+            tracing.add("unchanged")
+            return False
+        self.runs[src] = uf.KnownRun(self.marks[src])
+        return True
+
+    def end_source(self, src: str):
+        run = self.runs.pop(src, None)
+        if run is not None:
+            self.marks[src] = run.first or self.marks[src]
+
+    def offer(self, src: str, idx: int, ep, title_txt: str) -> bool:
+        """Añade el ítem si es nuevo; True si ya no hace falta leer más de `src`."""
+        run = self.runs[src]
         try:
-            return func(*args), args
-        except TypeError:
-            continue
-        except Exception:
-            # Si la función lanza otra excepción, la propagamos (no la ignoramos),
-            # porque puede ser un error real al procesar contenido.
-            raise
-    return None, None
-
-def update_feed_dir_iniciativas(feed_dir: str, search_text: str, source_filename: str):
-    print(f"\n--- Procesando carpeta: {feed_dir} (buscar '{search_text}' usando {source_filename}) ---")
-    source_file = os.path.join(feed_dir, source_filename)
-    dest_file = os.path.join(feed_dir, "feed.xml")
-
-    if not os.path.exists(source_file):
-        print(f"⏭️  Omitido: no existe el archivo de fuentes: {source_file}")
-        return
-    if not os.path.exists(dest_file):
-        print(f"⏭️  Omitido: no existe el feed destino: {dest_file}")
-        return
-
-    with open(source_file, "r", encoding="utf-8") as f:
-        source_urls = [ln.strip() for ln in f if ln.strip()]
-    print(f"  - URLs en {source_filename}: {len(source_urls)}")
-    if not source_urls:
-        print("ℹ️  Archivo de fuentes vacío.")
-        return
-
-    with open(dest_file, "r", encoding="utf-8") as f:
-        dest_xml = f.read()
-
-    # Datos del feed destino (para avisos y op3)
-    atom_link = uf.find_attr(dest_xml, "atom:link", "href") or ""
-    feed_image = uf.find_attr(dest_xml, "itunes:image", "href") or ""
-    op3_prefix = uf.find_tag_text(dest_xml, "op3") or ""
-    print(f"  - atom:link (destino): '{atom_link}'")
-    print(f"  - itunes:image (canal): '{feed_image}'")
-    print(f"  - op3 prefix: '{op3_prefix}'")
-
-    existing = uf.existing_keys_from_feed(dest_xml)
-    print(f"  - items ya existentes en feed destino: {len(existing)} keys")
+            print(f"    * Item {idx}: title='{title_txt[:70]}' -> {self.view.feed_dir}")
+            key = ep.key
+            if key in self.existing:
+                print("      - Ya existe en feed destino -> saltando")
+                if run.stop_after(key, True):
+                    print(f"   - {run.count} ítems seguidos ya conocidos -> fin de la fuente")
+                    return True
+                return False
+            run.stop_after(key, False)
+
+            with tracing.stage("sec"):
+                sec_id = self.existing.allocate_sec(key, str(self.om_counter))
+
+            new_item = self.render(ep, title_txt, sec_id)
+
+            self.new_items.append(new_item)
+            self.existing.add(key, uf.find_tag_text(new_item, "om:sec") or sec_id)
+            tracing.add("regex_passes")
+            tracing.add("items_new")
+            self.om_counter += 1
 
-    new_items = []
-    om_counter = 1
-
-    for src in source_urls:
-        print(f"\n  Leyendo fuente: {src}")
-        try:
-            raw_items = uf.fetch_source_items(src)
         except Exception as e:
-            print(f"  ⚠️ Error al obtener items de {src}: {e}")
+            print(f"    ⚠️ Error procesando item {idx} de {src}: {e}")
             traceback.print_exc()
-            continue
+            self.failed.add(src)
+        return False
+
+    def render(self, ep, title_txt: str, sec_id: str) -> str:
+        with tracing.stage("render"):
+            new_item = uf.render_item(ep, self.feed_image, self.atom_link, sec_id)
+
+        # Prefijo OP3 en enclosure (si aplica) y tags itunes, sobre el
+        # ítem troceado una sola vez
+        item = uf.ItemXml(new_item)
+        if self.op3_prefix and uf.apply_op3(item, self.op3_prefix):
+            print("      - Se aplicó op3 prefix a enclosure")
+
+        # Forzar tags itunes
+        return ensure_itunes_tags(item, title_txt)
+
+    def mark_processed(self):
+        """Recuerda versión y marca de las fuentes; las fallidas, para leerlas enteras."""
+        versions = {src: v for src, v in self.versions.items() if src not in self.failed}
+        marks = {**self.marks, **dict.fromkeys(self.failed, uf.FULL_READ)}
+        uf.fetcher.mark_processed(self.view.consumer, self.feed_sig, versions, marks)
+
+    def finish(self):
+        view, dest_file = self.view, self.view.dest_file
+        with tracing.span("feed_dir", dir=view.feed_dir):
+            if not self.new_items:
+                if self.existing.rebuilt:
+                    self.existing.save(dest_file)
+                self.mark_processed()
+                print(f"= {view.feed_dir}: no se añadieron episodios nuevos (filtro / duplicados / errores).")
+                return
+
+            # Insertar arriba (antes del primer <item>)
+            with tracing.stage("write"):
+                self.feed_sig = uf.write_new_items(dest_file, self.head, self.has_items, self.new_items)
+                self.existing.stamp(dest_file, self.feed_sig)
+                self.existing.save(dest_file)
+            self.mark_processed()
+
+        print(f"✅ {view.feed_dir}: añadidos {len(self.new_items)} episodios nuevos")
+        print(f"  - Feed destino actualizado en: {dest_file}")
+
+def run_views(view_list: list):
+    """
+    Ejecuta las vistas en una sola pasada: cada fuente se descarga y se
+    trocea una vez y sus ítems se reparten con un Router entre las vistas que
+    la usan. Cada vista deja de leer una fuente cuando su parada temprana lo
+    dice; la fuente se abandona cuando ya no queda ninguna leyendo (si solo
+    se había bajado su cabeza y alguna sigue leyendo, se baja entera).
+    """
+    runs = [r for r in (ViewRun(v) for v in view_list) if r.open()]
+    if not runs:
+        return
+    sources = list(dict.fromkeys(src for r in runs for src in r.view.sources))
+    uf.fetcher.prefetch(sources)
 
-        print(f"   - Ítems recuperados: {len(raw_items)}")
-        for idx, raw_item in enumerate(raw_items, start=1):
+    for src in sources:
+        with tracing.span("source", url=src):
+            users = [r for r in runs if src in r.view.sources]
+            print(f"\n  Leyendo fuente: {src} ({len(users)} vistas)")
             try:
-                title_inner = uf.find_tag_text(raw_item, "title")
-                title_txt = uf.strip_cdata(title_inner)
-                matches = (search_text.lower() in title_txt.lower())
-                print(f"    * Item {idx}: title='{title_txt[:70]}'... match={matches}")
-
-                if not matches:
-                    continue
-
-                key = uf.item_key_from_xml(raw_item)
-                if key in existing:
-                    print("      - Ya existe en feed destino -> saltando")
-                    continue
-
-                link_inner = uf.find_tag_text(raw_item, "link")
-                img = (uf.find_attr(raw_item, "itunes:image", "href")
-                       or uf.find_attr(raw_item, "media:thumbnail", "url")
-                       or "")
-                desc_inner = uf.find_tag_text(raw_item, "description")
-
-                sec_id = str(om_counter)
-
-                # Llamar a process_description_block con distintas firmas posibles.
-                # Probamos variantes (de mayor a menor aridad), para mantener compat.
-                process_variants = [
-                    (uf.strip_cdata(title_inner), uf.strip_cdata(link_inner), img, desc_inner, feed_image, atom_link, sec_id),
-                    (uf.strip_cdata(title_inner), uf.strip_cdata(link_inner), img, desc_inner, atom_link, sec_id, feed_image),
-                    (uf.strip_cdata(title_inner), uf.strip_cdata(link_inner), img, desc_inner, feed_image, sec_id),
-                    (uf.strip_cdata(title_inner), uf.strip_cdata(link_inner), img, desc_inner, feed_image),
-                    (uf.strip_cdata(title_inner), uf.strip_cdata(link_inner), img, desc_inner),
-                ]
-                new_desc, used = try_call(uf.process_description_block, process_variants)
-                if new_desc is None:
-                    raise RuntimeError("No se pudo llamar a process_description_block con ninguna firma conocida.")
-                print(f"      - process_description_block llamada con {len(used)} args")
-
-                # Llamar a replace_description con variantes posibles
-                replace_variants = [
-                    (raw_item, new_desc, sec_id, atom_link),
-                    (raw_item, new_desc, new_desc, sec_id),
-                    (raw_item, new_desc),
-                ]
-                replaced, used2 = try_call(uf.replace_description, replace_variants)
-                if replaced is None:
-                    raise RuntimeError("No se pudo llamar a replace_description con ninguna firma conocida.")
-                new_item = replaced
-                print(f"      - replace_description llamada con {len(used2)} args")
-
-                # Prefijo OP3 en enclosure (si aplica)
-                if op3_prefix:
-                    m = re.search(r'<enclosure\b([^>]*)url="([^"]+)"([^>]*)/?>', new_item, flags=re.IGNORECASE)
-                    if m:
-                        orig_url = m.group(2)
-                        new_url = op3_prefix.strip() + orig_url
-                        new_item = re.sub(r'(<enclosure\b[^>]*url=")[^"]+(")', rf'\1{new_url}\2', new_item, flags=re.IGNORECASE)
-                        print("      - Se aplicó op3 prefix a enclosure")
-
-                # Forzar tags itunes
-                new_item = ensure_itunes_tags(new_item, title_txt)
-
-                new_items.append(new_item)
-                existing.add(key)
-                om_counter += 1
-
+                with tracing.stage("fetch_wait"):
+                    fetched = uf.fetcher.fetch(src)
             except Exception as e:
-                print(f"    ⚠️ Error procesando item {idx} de {src}: {e}")
+                print(f"  ⚠️ Error al obtener items de {src}: {e}")
                 traceback.print_exc()
                 continue
+            started = [r for r in users if r.start_source(src, fetched)]
+            if not started:
+                continue
+            active = list(started)
+            by_view = {id(r.view): r for r in active}
+            router = views.Router(r.view for r in active)
+            items = uf.SourceItems(fetched)
 
-    if not new_items:
-        print("\n= Resultado: no se añadieron episodios nuevos (filtro / duplicados / errores).")
-        return
-
-    # Insertar arriba (antes del primer <item>)
-    insertion_block = "\n".join(new_items)
-    first_item = re.search(r"<item\b", dest_xml, flags=re.IGNORECASE)
-    if first_item:
-        insert_pos = first_item.start()
-        updated_xml = dest_xml[:insert_pos] + insertion_block + "\n" + dest_xml[insert_pos:]
-    else:
-        updated_xml = re.sub(r"</channel>\s*$", insertion_block + "\n</channel>", dest_xml,
-                             flags=re.IGNORECASE | re.DOTALL)
+            try:
+                for idx, ep in enumerate(items, start=1):
+                    tracing.add("items_scanned")
+                    title_txt = uf.strip_cdata(ep.title)
+                    for view in router.route(ep, title_txt):
+                        run = by_view[id(view)]
+                        if run.offer(src, idx, ep, title_txt):
+                            active.remove(run)
+                            del by_view[id(view)]
+                            router = views.Router(r.view for r in active)
+                    if not active:
+                        break
+            except Exception as e:
+                # la fuente entera (tras la cabeza) no se ha podido bajar: las
+                # vistas que seguían leyendo la vuelven a leer entera la próxima vez
+                print(f"  ⚠️ Error al obtener items de {src}: {e}")
+                traceback.print_exc()
+                for r in started:
+                    r.versions.pop(src, None)
+                for r in active:
+                    r.failed.add(src)
+            else:
+                for r in started:
+                    r.versions[src] = items.src.version
+            for r in users:
+                r.end_source(src)
+            uf.release_source(src)
+
+    for r in runs:
+        r.finish()
 
-    with open(dest_file, "w", encoding="utf-8") as f:
-        f.write(updated_xml)
+def update_feed_dir_iniciativas(feed_dir: str, search_text: str, source_filename: str):
+    """Modo clásico: una vista de `feed_dir` con un solo text y las URLs de `source_filename`."""
+    view = legacy_view(feed_dir, search_text, source_filename)
+    if view is not None:
+        run_views([view])
 
-    print(f"\n✅ {feed_dir}: añadidos {len(new_items)} episodios nuevos que contienen '{search_text}'")
-    print(f"  - Feed destino actualizado en: {dest_file}")
+def legacy_view(feed_dir: str, search_text: str, source_filename: str):
+    source_file = os.path.join(feed_dir, source_filename)
+    if not os.path.exists(source_file):
+        return None
+    dest_file = os.path.join(feed_dir, "feed.xml")
+    # mismo consumer que antes, para conservar marcas y firmas de fetcher
+    return views.View(feed_dir, uf.read_source_urls(source_file), texts=[search_text],
+                      consumer=f"{dest_file}|{search_text.lower()}")
+
+def update_all_iniciativas(base: str, search_text: str = None, source_filename: str = None, only=None):
+    """Vistas de view.txt o, con search_text y source_filename, las del modo clásico."""
+    dirs = uf.feed_dirs(base, only)
+    if search_text:
+        view_list = [v for v in (legacy_view(path, search_text, source_filename) for path in dirs) if v is not None]
+    else:
+        view_list = views.load_views(base, dirs)
+    run_views(view_list)
 
 def main():
-    parser = argparse.ArgumentParser(description="Actualizar feeds filtrando por título.")
-    parser.add_argument("--text", required=True, help="Texto a buscar en el título (insensible a mayúsculas).")
-    parser.add_argument("--source", required=True, help="Archivo fuente (ej. imetal.txt, imario.txt).")
+    parser = argparse.ArgumentParser(
+        description="Actualizar feeds filtrando por título. Sin argumentos ejecuta las vistas "
+                    f"declaradas en public/*/{views.VIEW_FILE}."
+    )
+    parser.add_argument("--text", help="Texto a buscar en el título (insensible a mayúsculas).")
+    parser.add_argument("--source", help="Archivo fuente (ej. imetal.txt, imario.txt).")
     args = parser.parse_args()
+    if bool(args.text) != bool(args.source):
+        parser.error("--text y --source van juntos")
 
     base = os.path.join(os.getcwd(), "public")
     if not os.path.isdir(base):
         print("❌ No existe la carpeta 'public'")
         return
 
-    for name in os.listdir(base):
-        path = os.path.join(base, name)
-        if os.path.isdir(path):
-            update_feed_dir_iniciativas(path, args.text, args.source)
+    with tracing.run("update_iniciativas", text=args.text, source=args.source):
+        update_all_iniciativas(base, args.text, args.source)
+        uf.fetcher.finish_run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,187 @@
+# scripts/views.py
+
+"""
+Vistas filtradas: feeds destino que se llenan con los ítems de unas fuentes
+que cumplen un filtro. update_iniciativas.py las ejecuta todas en una pasada:
+cada fuente se descarga y se trocea una vez y cada ítem se reparte entre las
+vistas que lo aceptan.
+
+Cada carpeta de public/ con un view.txt es una vista. Una clave por línea
+(se pueden repetir), # para comentarios:
+
+    source: imetal.txt              fichero de URLs, relativo a la carpeta
+    https://...                     o URLs sueltas (con espejos: url1 | url2)
+    text: Iniciativa Metal Gear     subcadena del título, sin mayúsculas
+    regex: ^Iniciativa (Super )?Mario\\b
+    season: 1                       itunes:season del ítem de origen
+    since: 2024-09-01               pubDate desde (incluido)
+    until: 2024-12-31               pubDate hasta (incluido)
+
+Un ítem entra si su título contiene algún text o casa con algún regex (o no
+hay ninguno) y además cumple season, since y until si están. Si cambia el
+filtro, la vista vuelve a leer sus fuentes enteras (sin marcas de la vez
+anterior) y recoge también los ítems antiguos que ahora cumplen.
+
+Los regex de todas las vistas se juntan en uno, así que no valen flags
+globales como (?i) (ya se compara sin mayúsculas; (?s:...) sí vale),
+referencias a grupos (\\1, (?P=n)) ni grupos con nombre.
+"""
+
+import datetime
+import email.utils
+import os
+import re
+
+import update_feeds as uf
+from feed_index import key_digest
+
+VIEW_FILE = "view.txt"
+
+# lo que deja de funcionar (o cambia de sentido) al juntar varios regex:
+# flags globales, referencias a grupos por número o nombre y grupos con nombre
+GLOBAL_FLAGS_RE = re.compile(r"\(\?[aiLmsux]+\)")
+BACKREF_RE = re.compile(r"(?<!\\)(?:\\\\)*\\(?:[1-9]|g<)|\(\?P[=<]")
+
+def check_regex(value: str) -> str:
+    """Devuelve `value` si se puede usar en una vista; si no, ValueError."""
+    re.compile(value)
+    if GLOBAL_FLAGS_RE.search(value):
+        raise ValueError(f"regex '{value}': flags globales como (?i) no valen aquí (usa (?i:...))")
+    if BACKREF_RE.search(value):
+        raise ValueError(f"regex '{value}': sin referencias a grupos ni grupos con nombre")
+    return value
+
+class View:
+    def __init__(self, feed_dir: str, sources=(), texts=(), regexes=(), seasons=(),
+                 since: datetime.date = None, until: datetime.date = None, consumer: str = None):
+        self.feed_dir = feed_dir
+        self.dest_file = os.path.join(feed_dir, "feed.xml")
+        self.sources = list(dict.fromkeys(sources))
+        self.texts = [t for t in texts if t]
+        self.regexes = list(regexes)
+        self.seasons = {str(s).strip() for s in seasons}
+        self.since, self.until = since, until
+        # nombre con el que fetcher guarda marcas y "sin cambios" de la vista;
+        # lleva el filtro, así que al cambiar view.txt la vista empieza de cero
+        self.consumer = consumer or f"{self.dest_file}|view|{self.filter_digest()}"
+        patterns = [re.escape(t) for t in self.texts] + self.regexes
+        self.title_re = re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+
+    def __repr__(self):
+        return f"View({self.feed_dir!r})"
+
+    def filter_digest(self) -> str:
+        """Resumen del filtro normalizado (el orden y las mayúsculas de text no cuentan)."""
+        spec = "\n".join([
+            "text:" + "|".join(sorted({t.lower() for t in self.texts})),
+            "regex:" + "|".join(sorted(set(self.regexes))),
+            "season:" + "|".join(sorted(self.seasons)),
+            f"since:{self.since or ''}",
+            f"until:{self.until or ''}",
+        ])
+        return key_digest(spec)
+
+    def accepts(self, ep: uf.Episode, title: str) -> bool:
+        """Comprueba season/since/until; el título ya lo ha mirado Router."""
+        if self.seasons and uf.strip_cdata(ep.season).strip() not in self.seasons:
+            return False
+        if self.since or self.until:
+            day = pub_day(ep)
+            if day is None or (self.since and day < self.since) or (self.until and day > self.until):
+                return False
+        return True
+
+def pub_day(ep: uf.Episode):
+    try:
+        return email.utils.parsedate_to_datetime(uf.strip_cdata(ep.pub_date).strip()).date()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def _date(value: str) -> datetime.date:
+    return datetime.date.fromisoformat(value.strip())
+
+def load_view(feed_dir: str):
+    """Lee <feed_dir>/view.txt; None si no hay. ValueError si está mal."""
+    path = os.path.join(feed_dir, VIEW_FILE)
+    if not os.path.exists(path):
+        return None
+    sources, texts, regexes, seasons = [], [], [], []
+    since = until = None
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            key, sep, value = line.partition(":")
+            key, value = key.strip().lower(), value.strip()
+            try:
+                if key in ("http", "https"):
+                    sources.append(line)
+                elif key == "source":
+                    sources.extend(uf.read_source_urls(os.path.join(feed_dir, value)))
+                elif key == "text":
+                    texts.append(value)
+                elif key == "regex":
+                    regexes.append(check_regex(value))
+                elif key == "season":
+                    seasons.append(value)
+                elif key == "since":
+                    since = _date(value)
+                elif key == "until":
+                    until = _date(value)
+                else:
+                    raise ValueError(f"clave desconocida '{key}'")
+            except (re.error, ValueError) as e:
+                raise ValueError(f"{path}:{n}: {e}") from None
+    try:
+        view = View(feed_dir, sources, texts, regexes, seasons, since, until)
+        Router([view])
+    except re.error as e:
+        raise ValueError(f"{path}: los regex no se pueden juntar: {e}") from None
+    return view
+
+def load_views(base: str, dirs=None) -> list:
+    """Vistas de las carpetas de `base` (o de `dirs`, si se pasa)."""
+    if dirs is None:
+        dirs = [os.path.join(base, name) for name in os.listdir(base)]
+    views = []
+    for path in sorted(dirs):
+        if not os.path.isdir(path):
+            continue
+        try:
+            view = load_view(path)
+        except ValueError as e:
+            print(f"⚠️  Vista ignorada: {e}")
+            continue
+        if view is not None:
+            views.append(view)
+    return views
+
+class Router:
+    """
+    Reparte los ítems de una fuente entre sus vistas. Los text/regex de todas
+    se juntan en una sola regex: un título que no casa con ella solo puede ir
+    a vistas sin filtro de título, que es lo normal en fuentes compartidas
+    donde casi nada es de ninguna vista. Si no se pueden juntar, se mira el
+    regex de cada vista por separado.
+    """
+    def __init__(self, views):
+        self.views = list(views)
+        filtered = [v for v in self.views if v.title_re is not None]
+        self.unfiltered = [v for v in self.views if v.title_re is None]
+        self.any_re = None
+        if filtered:
+            try:
+                self.any_re = re.compile("|".join(f"(?:{v.title_re.pattern})" for v in filtered),
+                                         re.IGNORECASE)
+            except re.error:
+                pass
+        self.separate = bool(filtered) and self.any_re is None
+
+    def route(self, ep: uf.Episode, title: str) -> list:
+        """Vistas (en el orden de la lista) que aceptan el ítem."""
+        if self.separate or (self.any_re is not None and self.any_re.search(title)):
+            candidates = [v for v in self.views if v.title_re is None or v.title_re.search(title)]
+        else:
+            candidates = self.unfiltered
+        return [v for v in candidates if v.accepts(ep, title)]